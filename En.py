@@ -1,192 +1,55 @@
 import os
 import re
-import io
 import time
 import base64
-import torch
+import logging
+import threading
+import contextlib
 import faiss
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 from typing import List, Dict, Tuple, Optional
-from transformers import T5ForConditionalGeneration, T5Tokenizer
-from sentence_transformers import SentenceTransformer
-
-print("🔄 Loading models... (this may take a few minutes on first run)")
-
-# Load models
+from batching import create_batcher
+from conversation import conversation_history
+from embedding_cache import EmbeddingCache
+from kb_index import KnowledgeSnapshot, build_search_index, entry_text, get_shared_index
+from knowledge_store import KnowledgeStore, DATA_DIR
+from ranking import (HYBRID_CANDIDATES, KEYWORD_MATCH_SCORE, lexical_is_decisive,
+                     ranked_ids, reciprocal_rank_fusion)
+from semantic_cache import SemanticCache
+from image_cache import file_base64, image_url, placeholder_base64, warm as warm_image_cache
+from models import embedding_model_for, query_model_for, load_generator, PRELOAD_MODELS, SHARED_EMBEDDING_MODEL
+from observability import fields, get_logger, timed
+
+log = get_logger('en')
+
+# Models load on first use; the T5 generator only in generative mode
 model_name = "google/flan-t5-base"
-tokenizer = T5Tokenizer.from_pretrained(model_name)
-model = T5ForConditionalGeneration.from_pretrained(model_name)
-model.eval()
-embedding_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+embedding_model_name = SHARED_EMBEDDING_MODEL or 'sentence-transformers/all-MiniLM-L6-v2'
+embedding_model = embedding_model_for(embedding_model_name)
+query_model = query_model_for(embedding_model_name)
 
+# Entries live in data/en.jsonl and are only parsed when the bot is initialized
+store = KnowledgeStore(os.path.join(DATA_DIR, 'en.jsonl'))
 kb = None
 chatbot = None
 
-print("✅ Models loaded successfully!")
-
 
 def initialize_bot():
     """Initialize chatbot and knowledge base."""
     global kb, chatbot
-    kb = EnhancedBusinessKnowledgeBase(business_data, embedding_model)
+    if PRELOAD_MODELS:
+        query_model.load()
+    kb = EnhancedBusinessKnowledgeBase(store.entries(), embedding_model,
+                                       query_model=query_model,
+                                       batcher=create_batcher(query_model),
+                                       cache=EmbeddingCache(embedding_model_name, 'en'),
+                                       store=store, language='en',
+                                       semantic_cache=SemanticCache(),
+                                       shared_index=get_shared_index() if SHARED_EMBEDDING_MODEL else None)
+    model, tokenizer = load_generator(model_name)
     chatbot = EnhancedBusinessChatbot(model, tokenizer, kb)
-
-
-# ---------------------------
-# Business Data
-# ---------------------------
-business_data = [
-    {
-        "question": "What does Visual Alpha do?",
-        "answer": "Visual Alpha is a Tokyo-based B2B fintech startup offering comprehensive SaaS data solutions that revolutionize how institutional investors and asset managers handle their data operations. Our AI-powered platform automates complex data processing, generates automated reports, and provides real-time portfolio monitoring capabilities. We specialize in transforming unstructured financial data into actionable insights, reducing manual Excel work by up to 80% for investment teams. Our solutions integrate seamlessly with existing systems and provide scalable infrastructure for managing large-scale institutional portfolios.",
-        "category": "company_overview",
-        "image_path": "images/company_overview.png",
-        "related_topics": ["services", "technology", "automation"],
-        "keywords": ["do", "does", "company", "business", "about", "overview", "services", "visual", "alpha", "fintech"], 
-    },
-    {
-        "question": "What are Visual Alpha's future goals?",
-        "answer": "Visual Alpha aims to expand its client base among global firms, bringing its data-driven solutions to a broader international audience. By partnering with leading organizations worldwide, the company plans to strengthen its presence in the global financial ecosystem and continue innovating to meet the evolving needs of institutional clients.",
-        "category": "future_goals",
-        "image_path": "images/future_goals.png",
-        "related_topics": ["global expansion", "clients", "growth", "international"],
-        "keywords": ["future", "goals", "expansion", "global", "plans", "vision", "roadmap"]
-    },
-    {
-        "question": "When was Visual Alpha founded?",
-        "answer": "Visual Alpha was established in December 2019 in Tokyo, Japan, during a period of significant digital transformation in the financial sector. Since our founding, we have experienced rapid growth, expanding our client base and technology capabilities. The company was born from the vision of creating more efficient, transparent, and automated solutions for institutional investment management. Our founders leveraged their extensive experience in investment management and data systems to address the growing need for sophisticated fintech solutions in the Japanese market.",
-        "category": "company_history",
-        "image_path": "images/company_timeline.png",
-        "related_topics": ["founding", "growth", "tokyo"],
-        "keywords": ["founded", "when", "established", "started", "history", "2019", "origin"]
-    },
-    {
-        "question": "How large is the Visual Alpha team?",
-        "answer": "As of 2025, Visual Alpha employs around 15-20 highly skilled professionals, including board directors, technical advisors, and core staff members. Our team represents a diverse, internationally-minded workforce with expertise spanning fintech, data science, software engineering, and financial services. We maintain a lean but highly effective organizational structure, with team members bringing experience from leading global financial institutions, technology companies, and consulting firms. Our collaborative culture emphasizes innovation, continuous learning, and delivering exceptional value to our institutional clients.",
-        "category": "team_info",
-        "image_path": "images/team_structure.png",
-        "related_topics": ["staff", "expertise", "culture"],
-        "keywords": ["team", "staff", "employees", "people", "size", "members", "workforce"]
-    },
-    {
-        "question": "Who leads Visual Alpha?",
-        "answer": "Visual Alpha is led by CEO Jeffrey Tsui, a seasoned professional with extensive experience in investment management data systems and financial technology. Before founding Visual Alpha, Jeffrey worked with prestigious organizations including State Street Corporation and Wellington Management, where he gained deep insights into the challenges faced by institutional investors in data management and reporting. His leadership combines technical expertise with strategic vision, driving the company's mission to transform how financial data is processed and utilized by institutional investors across Japan and beyond.",
-        "category": "leadership",
-        "image_path": "images/leadership_team.png",
-        "related_topics": ["ceo", "experience", "background"],
-        "keywords": ["ceo", "leader", "founder", "executive", "management", "jeffrey", "tsui", "who"]
-    },
-    {
-        "question": "Who are some of Visual Alpha's clients?",
-        "answer": "Visual Alpha serves a prestigious portfolio of institutional clients, including leading asset managers and pension funds in Japan. Our notable clients include Benesse Group Pension Fund, one of Japan's largest corporate pension funds; Sumitomo Mitsui DS Asset Management, a major asset management company; and Mercer Japan, a global leader in consulting services. These relationships demonstrate our ability to deliver enterprise-grade solutions that meet the stringent requirements of large-scale institutional investors, handling complex portfolio management, regulatory reporting, and data analytics needs.",
-        "category": "clients",
-        "image_path": "images/client_logos.png",
-        "related_topics": ["institutional_investors", "pension_funds", "asset_managers"],
-        "keywords": ["clients", "customers", "partners", "benesse", "sumitomo", "mercer", "who"]
-    },
-    {
-        "question": "What technologies does Visual Alpha use?",
-        "answer": "Visual Alpha's technology stack is built on modern, scalable architecture designed for high-performance financial data processing. Our backend infrastructure utilizes NodeJS for server-side development, ensuring fast and efficient data processing. The frontend is built with React, providing responsive and intuitive user interfaces. We use PHP with the Laravel framework for certain web applications, while our database layer is powered by MySQL for reliable data storage. Our API architecture includes both GraphQL and RESTful APIs for flexible data access. Cloud infrastructure is managed through AWS, providing scalability and security, while Docker containers ensure consistent deployment environments. Our CI/CD pipeline is powered by CircleCI for automated testing and deployment.",
-        "category": "technology",
-        "image_path": "images/tech_stack.png",
-        "related_topics": ["nodejs", "react", "aws", "api"],
-        "keywords": ["technology", "tech", "stack", "tools", "nodejs", "react", "aws", "docker", "database"]
-    },
-    {
-        "question": "What are Visual Alpha's main services?",
-        "answer": "Visual Alpha offers a comprehensive suite of financial technology services designed specifically for institutional investors. Our core services include: 1) Unstructured Data Processing - transforming complex financial documents, reports, and data feeds into structured, actionable information; 2) Content Automation - generating automated reports, presentations, and analytical documents that save hours of manual work; 3) Performance Calculation - providing accurate, real-time portfolio performance metrics and attribution analysis; 4) Portfolio Monitoring - continuous tracking of investment positions, risk metrics, and compliance requirements. All services are tailored for financial professionals managing large-scale institutional investments and integrate seamlessly with existing investment management workflows.",
-        "category": "services",
-        "image_path": "images/services_overview.png",
-        "related_topics": ["data_processing", "automation", "portfolio_management"],
-        "keywords": ["services", "offerings", "products", "solutions", "features", "capabilities"]
-    },
-    {
-        "question": "How do I delete a mandate?",
-        "answer": "First of all, you will need admin access to delete a mandate. From the application navbar, click on Clients → then click on the client from which you want to delete the mandate → you will be redirected to the client's Mandate Summary page where you can see all the listed mandates associated with that client → then click on the mandate you want to delete → you will be redirected to the Mandate Details page → then click on '...' on the top right corner → from the list that opens, click on 'Delete mandate'.",
-        "category": "mandate_management",
-        "image_path": "images/delete_mandate.png",
-        "related_topics": ["mandate", "delete", "admin", "client management"],
-        "keywords": ["delete", "mandate", "remove", "how", "admin", "client"]
-    },
-    {
-        "question": "What are the steps to remove a mandate from a client?",
-        "answer": "To remove a mandate, you must have admin access. Navigate to Clients from the navbar, select the specific client, view their Mandate Summary page showing all mandates, click on the target mandate to open Mandate Details, then click the '...' menu in the top right corner and select 'Delete mandate' from the dropdown options.",
-        "category": "mandate_management",
-        "image_path": "images/delete_mandate.png",
-        "related_topics": ["mandate", "delete", "admin", "client management"],
-        "keywords": ["remove", "mandate", "delete", "steps", "client", "admin"]
-    },
-    {
-        "question": "How can I delete a mandate in Visual Alpha?",
-        "answer": "Deleting a mandate requires admin access. From the application navbar, click on Clients, then select the client whose mandate you want to delete. On the client's Mandate Summary page, you'll see all associated mandates. Click on the mandate you wish to delete to open its Mandate Details page. Then click on the '...' menu button on the top right corner and select 'Delete mandate' from the options.",
-        "category": "mandate_management",
-        "image_path": "images/delete_mandate.png",
-        "related_topics": ["mandate", "delete", "admin", "client management"],
-        "keywords": ["delete", "mandate", "visual alpha", "how", "admin"]
-    },
-    {
-        "question": "What permissions do I need to delete a mandate?",
-        "answer": "You need admin access to delete a mandate. Once you have admin permissions, navigate to Clients → select the client → view the Mandate Summary page → click on the specific mandate → open the Mandate Details page → click '...' in the top right corner → select 'Delete mandate' from the dropdown menu.",
-        "category": "mandate_management",
-        "image_path": "images/delete_mandate.png",
-        "related_topics": ["mandate", "delete", "admin", "permissions"],
-        "keywords": ["permissions", "admin", "delete", "mandate", "access"]
-    },
-    {
-        "question": "Can I remove a mandate without admin access?",
-        "answer": "No, you cannot delete a mandate without admin access. Admin access is required to perform mandate deletion. If you have admin access, follow these steps: From the navbar, click Clients → select the client → go to Mandate Summary page → click the mandate to delete → open Mandate Details → click '...' on the top right → select 'Delete mandate'.",
-        "category": "mandate_management",
-        "image_path": "images/delete_mandate.png",
-        "related_topics": ["mandate", "delete", "admin", "permissions"],
-        "keywords": ["admin", "access", "remove", "mandate", "permissions", "without"]
-    },
-        {
-        "question": "How do I add a new client in Visual Alpha?",
-        "answer": "To add a new client, you need admin access. From the navbar, click on Clients → then click 'Add Client' → fill in the client details such as name, contact information, and relevant documents → click 'Save' to register the client in the system.",
-        "category": "client_management",
-        "image_path": "images/add_client.png",
-        "related_topics": ["clients", "admin", "add", "registration"],
-        "keywords": ["add", "client", "register", "new", "how", "create"],
-        "active": True
-    },
-    {
-        "question": "How do I update client information?",
-        "answer": "Navigate to Clients from the navbar → select the client you want to update → open the Client Details page → click 'Edit' → update the necessary information → click 'Save' to apply the changes.",
-        "category": "client_management",
-        "image_path": "images/edit_client.png",
-        "related_topics": ["clients", "update", "edit"],
-        "keywords": ["update", "edit", "client", "information", "how", "change"],
-        "active": True
-    },
-    {
-        "question": "How can I generate a report in Visual Alpha?",
-        "answer": "Go to the Reports section in the application → select the type of report you need → choose the relevant client or portfolio → apply any filters if necessary → click 'Generate' → the report will be displayed and can be exported as PDF or Excel.",
-        "category": "reporting",
-        "image_path": "images/generate_report.png",
-        "related_topics": ["reports", "export", "pdf", "excel"],
-        "keywords": ["generate", "report", "create", "export", "how", "view"],
-        "active": True
-    },
-    {
-        "question": "How do I assign a mandate to a client?",
-        "answer": "From the navbar, click Clients → select the client → navigate to the Mandate Summary page → click 'Add Mandate' → fill in the mandate details including type, duration, and permissions → click 'Save' to assign the mandate.",
-        "category": "mandate_management",
-        "image_path": "images/add_mandate.png",
-        "related_topics": ["mandate", "client", "assign", "admin"],
-        "keywords": ["assign", "mandate", "client", "add", "how", "create"],
-        "active": True
-    },
-    {
-        "question": "How do I update my profile in Visual Alpha?",
-        "answer": "Click on your profile icon in the top right corner → select 'Settings' → go to 'Profile' → update your information such as name, email, and password → click 'Save' to apply the changes.",
-        "category": "user_management",
-        "image_path": "images/update_profile.png",
-        "related_topics": ["profile", "user", "settings", "update"],
-        "keywords": ["update", "profile", "settings", "user", "change", "how"],
-        "active": True
-    }
-]
+    warm_image_cache(item.get('image_path') for item in kb.data)
 
 
 # ---------------------------
@@ -235,83 +98,302 @@ def create_sample_images():
 # Knowledge Base
 # ---------------------------
 class EnhancedBusinessKnowledgeBase:
-    def __init__(self, data, embedding_model):
-        self.data = data
+    def __init__(self, data, embedding_model, batcher=None, cache=None, store=None, query_model=None,
+                 language='en', shared_index=None, semantic_cache=None):
         self.embedding_model = embedding_model
-        self.index = None
-        self.category_index = {}
-        self.keyword_index = {}
-        self.build_index()
-
-    def build_index(self):
+        self.query_model = query_model or embedding_model
+        self.batcher = batcher
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+        self.store = store
+        self.language = language
+        self.shared_index = shared_index
+        self._write_lock = threading.Lock()
+        # Guards swapping the snapshot; held only for the swap itself, never while taking other locks
+        self._snapshot_lock = threading.Lock()
+        self._snapshot = None
+        self.build_index(data)
+
+    # Searchable state lives in an immutable snapshot that writers swap atomically.
+    @property
+    def data(self) -> List[Dict]:
+        return self._snapshot.data
+
+    @property
+    def index(self):
+        return self._snapshot.index
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    @property
+    def category_index(self) -> Dict[str, List[int]]:
+        return self._snapshot.category_index
+
+    @property
+    def keyword_index(self) -> Dict[str, List[int]]:
+        return self._snapshot.keyword_index
+
+    def build_index(self, data=None):
         """Build semantic and keyword indices."""
-        texts = [f"{item['question']} {item['answer']} {' '.join(item.get('related_topics', []))}" 
-                 for item in self.data]
-        embeddings = self.embedding_model.encode(texts)
-        dim = embeddings.shape[1]
-        self.index = faiss.IndexFlatIP(dim)
-        faiss.normalize_L2(embeddings)
-        self.index.add(embeddings.astype('float32'))
-
-        for i, item in enumerate(self.data):
-            cat = item.get('category', 'general')
-            self.category_index.setdefault(cat, []).append(i)
-            for kw in item.get('keywords', []):
-                self.keyword_index.setdefault(kw.lower(), []).append(i)
+        data = list(self.data if data is None else data)
+        with self._write_lock:
+            self._install(self._new_snapshot(data))
+
+    def _new_snapshot(self, data: List[Dict]) -> KnowledgeSnapshot:
+        texts = [entry_text(item) for item in data]
+        if self.shared_index is not None:
+            embeddings = self._embed(texts)
+            index = self._index_builder()(embeddings)
+        elif self.cache is not None:
+            embeddings, index = self.cache.load_or_build(texts, self.embedding_model.encode)
+        else:
+            embeddings = self._embed(texts)
+            index = build_search_index(embeddings)
+        return KnowledgeSnapshot(data, embeddings, index)
+
+    # Other workers may write the same store; their changes are picked up by
+    # rebuilding from the file, and writes start from what is on disk.
+    def store_changed(self) -> bool:
+        return self.store is not None and self.store.changed()
+
+    def refresh(self) -> bool:
+        """Rebuild from the store if another process changed it; returns whether it did."""
+        with self._write_lock:
+            return self._refresh_locked()
+
+    def _refresh_locked(self) -> bool:
+        if not self.store_changed():
+            return False
+        self._install(self._new_snapshot(list(self.store.entries())))
+        log.info("reloaded knowledge base changed on disk",
+                 extra=fields(language=self.language, entries=len(self._snapshot.data)))
+        return True
 
-    def keyword_match(self, query: str) -> List[int]:
+    def _store_locked(self):
+        return self.store.locked() if self.store is not None else contextlib.nullcontext()
+
+    def _index_builder(self):
+        """Index factory for new snapshots: a view of the shared index, or None for a private one."""
+        if self.shared_index is None:
+            return None
+        return lambda embeddings: self.shared_index.publish(self.language, embeddings, self)
+
+    def adopt_index(self, index, embeddings: np.ndarray):
+        """Point the current snapshot at a rebuilt shared index if it still holds `embeddings`.
+
+        Called by another language's writer while this one may be writing
+        too, so the check and the swap happen under the snapshot lock.
+        """
+        with self._snapshot_lock:
+            snap = self._snapshot
+            if snap is not None and snap.embeddings is embeddings:
+                self._snapshot = snap.with_index(index)
+
+    def _install(self, snapshot: KnowledgeSnapshot):
+        with self._snapshot_lock:
+            self._snapshot = snapshot
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        if self.cache is not None:
+            return self.cache.embed(texts, self.embedding_model.encode)
+        embeddings = np.ascontiguousarray(self.embedding_model.encode(texts), dtype='float32')
+        faiss.normalize_L2(embeddings)
+        return embeddings
+
+    def add_entry(self, item: Dict) -> int:
+        """Embed one new entry and append it to every index; returns its id."""
+        vector = self._embed([entry_text(item)])[0]
+        with self._write_lock, self._store_locked():
+            self._refresh_locked()
+            if self.store is not None:
+                self.store.append(item)
+            self._install(self._snapshot.with_added(item, vector, self._index_builder()))
+            return len(self._snapshot.data) - 1
+
+    def update_entry(self, idx: int, item: Dict):
+        """Replace entry `idx`, re-embedding it only if its text changed."""
+        with self._write_lock, self._store_locked():
+            self._refresh_locked()
+            snap = self._snapshot
+            if entry_text(item) == entry_text(snap.data[idx]):
+                vector = snap.embeddings[idx]
+            else:
+                vector = self._embed([entry_text(item)])[0]
+            if self.store is not None:
+                self.store.replace(idx, item)
+            self._install(snap.with_updated(idx, item, vector, self._index_builder()))
+
+    def delete_entry(self, idx: int):
+        with self._write_lock, self._store_locked():
+            self._refresh_locked()
+            if self.store is not None:
+                self.store.delete(idx)
+            self._install(self._snapshot.with_deleted(idx, self._index_builder()))
+
+    def keyword_match(self, query: str, snapshot=None) -> List[int]:
         """Keyword-based fallback matching."""
+        snap = snapshot or self._snapshot
+        keyword_index = snap.keyword_index
         query_lower = query.lower().strip()
         matches = {}
-        # exact phrase
-        for kw in self.keyword_index:
-            if kw in query_lower:
-                for idx in self.keyword_index[kw]:
-                    matches[idx] = matches.get(idx, 0) + len(kw.split())
+        # exact phrase, every keyword found in one pass over the query
+        for kw in snap.keyword_automaton.find(query_lower):
+            for idx in keyword_index[kw]:
+                matches[idx] = matches.get(idx, 0) + len(kw.split())
         # individual words
         for w in re.findall(r'\w+', query_lower):
-            if w in self.keyword_index:
-                for idx in self.keyword_index[w]:
+            if w in keyword_index:
+                for idx in keyword_index[w]:
                     matches[idx] = matches.get(idx, 0) + 0.5
         return [idx for idx, score in sorted(matches.items(), key=lambda x: x[1], reverse=True) if score >= 1]
 
-    def search(self, query: str, top_k=2, min_score=0.30) -> List[Dict]:
-        """Hybrid search: semantic + keyword fallback."""
-        keyword_matches = self.keyword_match(query)
-        query_emb = self.embedding_model.encode([query])
+    def embed_query(self, query: str) -> np.ndarray:
+        """Normalized `(1, dim)` query embedding, micro-batched when a batcher is set."""
+        with timed('embed', self.language):
+            if self.batcher is not None:
+                return self.batcher.embed(query)
+            query_emb = np.ascontiguousarray(self.query_model.encode([query]), dtype='float32')
+            faiss.normalize_L2(query_emb)
+            return query_emb
+
+    def embed_and_search(self, query: str, top_k: int,
+                         index=None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Query embedding plus `index.search` hits, one micro-batched round-trip when a batcher is set."""
+        if index is None:
+            index = self._snapshot.searcher
+        if self.batcher is not None:
+            return self.batcher.embed_and_search(index, query, top_k)
+        query_emb = np.ascontiguousarray(self.query_model.encode([query]), dtype='float32')
         faiss.normalize_L2(query_emb)
-        scores, indices = self.index.search(query_emb.astype('float32'), top_k)
-        results = []
+        scores, indices = index.search(query_emb, top_k)
+        return query_emb, scores, indices
 
-        if keyword_matches:
-            idx = keyword_matches[0]
-            score = 0.6 if idx not in indices[0] else float(scores[0][list(indices[0]).index(idx)])
-            results.append({
-                'text': self.data[idx]['answer'],
-                'score': score,
-                'question': self.data[idx]['question'],
-                'category': self.data[idx].get('category', 'general'),
-                'image_path': self.data[idx].get('image_path'),
-                'related_topics': self.data[idx].get('related_topics', []),
-                'match_type': 'keyword'
-            })
+    def lexical_search(self, query: str, top_k: int, snapshot=None) -> Tuple[np.ndarray, np.ndarray]:
+        """BM25 over question + answer text, shaped like `semantic_search`."""
+        return (snapshot or self._snapshot).bm25.search(query, top_k)
+
+    def search(self, query: str, top_k=2, min_score=0.30) -> List[Dict]:
+        """Hybrid search: keyword, BM25 and semantic rankings fused by reciprocal rank."""
+        snap = self._snapshot
+        with timed('keyword_match', self.language):
+            keyword_matches = self.keyword_match(query, snap)
+        with timed('bm25', self.language):
+            lex_scores, lex_indices = self.lexical_search(query, HYBRID_CANDIDATES, snap)
+        # A clear lexical winner is answered without running the encoder.
+        if lexical_is_decisive(keyword_matches, lex_scores, lex_indices):
+            log.debug("keyword match", extra=fields(query=query, question=snap.data[keyword_matches[0]]['question']))
+            return [self._result(snap, keyword_matches[0], KEYWORD_MATCH_SCORE, 'keyword')]
+
+        with timed('embed_search', self.language):
+            query_emb, scores, indices = self.embed_and_search(query, max(top_k, HYBRID_CANDIDATES), snap.searcher)
+        if self.semantic_cache is not None:
+            with timed('semantic_cache', self.language):
+                cached = self.semantic_cache.lookup(query_emb, snap.version, (top_k, min_score))
+            if cached is not None:
+                log.debug("semantic cache hit", extra=fields(query=query))
+                return list(cached)
+        results = self._fuse(snap, query, top_k, min_score, keyword_matches, lex_indices, scores, indices)
+        if self.semantic_cache is not None:
+            self.semantic_cache.store(query_emb, snap.version, results, (top_k, min_score))
+        return results
+
+    def search_batch(self, queries: List[str], top_k=2, min_score=0.30) -> List[List[Dict]]:
+        """`search` for many queries at once, in order.
+
+        Queries not settled by the lexical fast path are encoded in one call
+        and searched with one index search.
+        """
+        snap = self._snapshot
+        results: List[Optional[List[Dict]]] = [None] * len(queries)
+        lexical = {}
+        with timed('batch_lexical', self.language):
+            for i, query in enumerate(queries):
+                keyword_matches = self.keyword_match(query, snap)
+                lex_scores, lex_indices = self.lexical_search(query, HYBRID_CANDIDATES, snap)
+                if lexical_is_decisive(keyword_matches, lex_scores, lex_indices):
+                    results[i] = [self._result(snap, keyword_matches[0], KEYWORD_MATCH_SCORE, 'keyword')]
+                else:
+                    lexical[i] = (keyword_matches, lex_indices)
+        if not lexical:
             return results
 
-        for idx, score in zip(indices[0], scores[0]):
-            if score > min_score:
-                results.append({
-                    'text': self.data[idx]['answer'],
-                    'score': float(score),
-                    'question': self.data[idx]['question'],
-                    'category': self.data[idx].get('category', 'general'),
-                    'image_path': self.data[idx].get('image_path'),
-                    'related_topics': self.data[idx].get('related_topics', []),
-                    'match_type': 'semantic'
-                })
+        pending = list(lexical)
+        with timed('batch_embed', self.language):
+            embeddings = np.ascontiguousarray(self.query_model.encode([queries[i] for i in pending]), dtype='float32')
+            faiss.normalize_L2(embeddings)
+        rows = []
+        for row, i in enumerate(pending):
+            if self.semantic_cache is not None:
+                cached = self.semantic_cache.lookup(embeddings[row:row + 1], snap.version, (top_k, min_score))
+                if cached is not None:
+                    results[i] = list(cached)
+                    continue
+            rows.append(row)
+        if not rows:
+            return results
+
+        with timed('batch_faiss_search', self.language):
+            scores, indices = snap.searcher.search(embeddings[rows], max(top_k, HYBRID_CANDIDATES))
+        for n, row in enumerate(rows):
+            i = pending[row]
+            keyword_matches, lex_indices = lexical[i]
+            results[i] = self._rank(snap, top_k, min_score, keyword_matches, lex_indices,
+                                    scores[n:n + 1], indices[n:n + 1])
+            if self.semantic_cache is not None:
+                self.semantic_cache.store(embeddings[row:row + 1], snap.version, results[i], (top_k, min_score))
+        return results
+
+    def _fuse(self, snap, query: str, top_k: int, min_score: float, keyword_matches: List[int],
+              lex_indices: np.ndarray, scores: np.ndarray, indices: np.ndarray) -> List[Dict]:
+        results = self._rank(snap, top_k, min_score, keyword_matches, lex_indices, scores, indices)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("hybrid search", extra=fields(
+                query=query, keyword=keyword_matches[:3], bm25=ranked_ids(lex_indices)[:3],
+                semantic=[(int(idx), round(float(score), 4)) for idx, score in zip(indices[0][:3], scores[0][:3])],
+                results=[(r['question'][:60], r['match_type']) for r in results]))
+        return results
+
+    def _rank(self, snap, top_k: int, min_score: float, keyword_matches: List[int], lex_indices: np.ndarray,
+              scores: np.ndarray, indices: np.ndarray) -> List[Dict]:
+        """Rank the candidate pool by fused rank; scores stay cosine similarities.
+
+        Every result must clear `min_score`. The top curated keyword hit is
+        the fallback when nothing does, so a short, common keyword alone
+        cannot surface several unrelated entries.
+        """
+        semantic = {int(idx): float(score) for idx, score in zip(indices[0], scores[0]) if idx >= 0}
+        lexical = set(ranked_ids(lex_indices))
+        keywords = set(keyword_matches)
+        results = []
+        for idx in reciprocal_rank_fusion([keyword_matches[:HYBRID_CANDIDATES], ranked_ids(lex_indices),
+                                           ranked_ids(indices)]):
+            if semantic.get(idx, 0.0) > min_score:
+                match_type = 'keyword' if idx in keywords else 'hybrid' if idx in lexical else 'semantic'
+                results.append(self._result(snap, idx, semantic[idx], match_type))
+            if len(results) == top_k:
+                break
+        if not results and keyword_matches:
+            idx = keyword_matches[0]
+            results.append(self._result(snap, idx, semantic.get(idx, KEYWORD_MATCH_SCORE), 'keyword'))
         return results
 
+    def _result(self, snap, idx: int, score: float, match_type: str) -> Dict:
+        item = snap.data[idx]
+        return {
+            'text': item['answer'],
+            'score': score,
+            'question': item['question'],
+            'category': item.get('category', 'general'),
+            'image_path': item.get('image_path'),
+            'related_topics': item.get('related_topics', []),
+            'match_type': match_type
+        }
+
     def get_related_content(self, category: str, exclude_idx=None) -> List[Dict]:
-        return [self.data[i] for i in self.category_index.get(category, []) if i != exclude_idx][:2]
+        snap = self._snapshot
+        return [snap.data[i] for i in snap.category_index.get(category, []) if i != exclude_idx][:2]
 
 
 # ---------------------------
@@ -322,7 +404,7 @@ class EnhancedBusinessChatbot:
         self.model = model
         self.tokenizer = tokenizer
         self.kb = kb
-        self.conversation_history = []
+        self.conversation_history = conversation_history()
         self.confidence_threshold = 0.30
         self.max_response_length = 500
 
@@ -360,6 +442,17 @@ class EnhancedBusinessChatbot:
             return self._handle_out_of_context("Empty query")
 
         results = self.kb.search(user_query, top_k=2, min_score=self.confidence_threshold)
+        return self._respond(user_query, results)
+
+    def generate_batch(self, user_queries: List[str]) -> List[Tuple[str, Optional[str], List[str]]]:
+        """`generate_detailed_response` for many queries, searched together."""
+        queries = [q.strip() for q in user_queries]
+        searched = iter(self.kb.search_batch([q for q in queries if q], top_k=2,
+                                             min_score=self.confidence_threshold) if any(queries) else [])
+        return [self._respond(q, next(searched)) if q else self._handle_out_of_context("Empty query")
+                for q in queries]
+
+    def _respond(self, user_query: str, results: List[Dict]) -> Tuple[str, Optional[str], List[str]]:
         if not results:
             return self._handle_out_of_context(user_query)
 
@@ -391,11 +484,9 @@ class EnhancedBusinessChatbot:
 # ---------------------------
 def encode_image_to_base64(image_path: str) -> Optional[str]:
     try:
-        if os.path.exists(image_path):
-            with open(image_path, "rb") as f:
-                return base64.b64encode(f.read()).decode('utf-8')
+        return file_base64(image_path)
     except Exception as e:
-        print(f"Error encoding image: {e}")
+        log.warning("image encoding failed", extra=fields(path=image_path, error=str(e)))
     return None
 
 
@@ -412,43 +503,97 @@ def create_placeholder_image(text="Visual Alpha", size=(400, 200)) -> Image:
     return img
 
 
-def enhanced_chat_response(user_input: str) -> Dict:
-    try:
-        if chatbot is None:
-            raise ValueError("Chatbot not initialized. Call initialize_bot() first.")
+def chat_answer(user_input: str) -> Dict:
+    """Retrieval half of a chat response: answer text, topics and confidence, no image yet."""
+    if chatbot is None:
+        raise ValueError("Chatbot not initialized. Call initialize_bot() first.")
+
+    return _answer(*chatbot.generate_detailed_response(user_input))
 
-        response, image_path, related_topics = chatbot.generate_detailed_response(user_input)
 
-        if image_path:
+def _answer(response: str, image_path: Optional[str], related_topics: List[str]) -> Dict:
+    return {
+        'response': response,
+        'image_path': image_path,
+        'related_topics': related_topics,
+        'conversation_length': len(response.split()),
+        'confidence': 'high' if image_path else 'out_of_context'
+    }
+
+
+def chat_image(image_path: Optional[str], related_topics: List[str], image_mode: str = 'base64') -> Dict:
+    """Image half: a cacheable URL in 'url' mode, otherwise base64 (a placeholder if unreadable)."""
+    url = image_url(image_path) if image_path and image_mode == 'url' else None
+    if url:
+        image_data = None
+    elif image_path:
+        with timed('image_encode', 'en'):
             image_data = encode_image_to_base64(image_path)
             if not image_data:
-                placeholder = create_placeholder_image(f"Visual Alpha - {related_topics[0] if related_topics else 'Info'}")
-                buffer = io.BytesIO()
-                placeholder.save(buffer, format='PNG')
-                image_data = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        else:
-            image_data = None
+                image_data = placeholder_base64(f"Visual Alpha - {related_topics[0] if related_topics else 'Info'}",
+                                                create_placeholder_image)
+    else:
+        image_data = None
+    return {'image_base64': image_data, 'image_url': url}
 
-        confidence = 'high' if image_path else 'out_of_context'
 
-        return {
-            'response': response,
-            'image_base64': image_data,
-            'image_path': image_path,
-            'related_topics': related_topics,
-            'conversation_length': len(response.split()),
-            'confidence': confidence
-        }
+def chat_confidence(answer: Dict, image: Dict) -> str:
+    """Confidence once the image is known; unreadable images get a placeholder, so retrieval decides it."""
+    return answer['confidence']
 
-    except Exception as e:
-        return {
-            'response': "I apologize, I encountered an error. Please try asking your question differently.",
-            'image_base64': None,
-            'image_path': None,
-            'related_topics': [],
-            'conversation_length': 0,
-            'confidence': 'error'
-        }
+
+def enhanced_chat_response(user_input: str, image_mode: str = 'base64') -> Dict:
+    """Answer `user_input`; image_mode='url' returns a cacheable image URL instead of inline base64."""
+    try:
+        return _with_image(chat_answer(user_input), image_mode)
+    except Exception:
+        log.exception("chat response failed", extra=fields(query=user_input))
+        return _error_response()
+
+
+def batch_chat_response(user_inputs: List[str], image_mode: str = 'base64') -> List[Dict]:
+    """`enhanced_chat_response` for many inputs, in order, with one encoder call and one index search.
+
+    A failure while retrieving fails the whole batch; a failure on one
+    item's image only marks that item as an error.
+    """
+    if chatbot is None:
+        raise ValueError("Chatbot not initialized. Call initialize_bot() first.")
+
+    results = []
+    for user_input, answer in zip(user_inputs, chatbot.generate_batch(user_inputs)):
+        try:
+            results.append(_with_image(_answer(*answer), image_mode))
+        except Exception:
+            log.exception("chat response failed", extra=fields(query=user_input))
+            results.append(_error_response())
+    return results
+
+
+def _with_image(answer: Dict, image_mode: str) -> Dict:
+    image = chat_image(answer['image_path'], answer['related_topics'], image_mode)
+    return {
+        'response': answer['response'],
+        'image_base64': image['image_base64'],
+        'image_url': image['image_url'],
+        'image_path': answer['image_path'],
+        'related_topics': answer['related_topics'],
+        'conversation_length': answer['conversation_length'],
+        'confidence': answer['confidence']
+    }
+
+
+def _error_response() -> Dict:
+    return {
+        'response': "I apologize, I encountered an error. Please try asking your question differently.",
+        'image_base64': None,
+        'image_url': None,
+        'image_path': None,
+        'related_topics': [],
+        'conversation_length': 0,
+        'confidence': 'error',
+        'error': True
+    }
 
 
 # ---------------------------
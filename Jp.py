@@ -1,139 +1,55 @@
-import torch
-from transformers import T5ForConditionalGeneration, T5Tokenizer
-from sentence_transformers import SentenceTransformer
+from batching import create_batcher
+from conversation import conversation_history
+from embedding_cache import EmbeddingCache
+from kb_index import KnowledgeSnapshot, build_search_index, entry_text, get_shared_index
+from knowledge_store import KnowledgeStore, DATA_DIR
+from ranking import (HYBRID_CANDIDATES, KEYWORD_MATCH_SCORE, lexical_is_decisive,
+                     ranked_ids, reciprocal_rank_fusion)
+from semantic_cache import SemanticCache
+from tokenization import get_tokenizer
+from image_cache import file_base64, image_url, warm as warm_image_cache
+from models import embedding_model_for, query_model_for, load_generator, PRELOAD_MODELS, SHARED_EMBEDDING_MODEL
+from observability import fields, get_logger, timed
 import faiss
 import numpy as np
 import base64
 from PIL import Image, ImageDraw, ImageFont
-import io
 import os
 import time
+import threading
+import contextlib
 import re
+import logging
 from typing import List, Dict, Tuple, Optional
 
-print("🔄 日本語モデルを読み込んでいます... (初回実行時は数分かかる場合があります)")
+log = get_logger('jp')
 
+# Models load on first use; the T5 generator only in generative mode
 model_name = "sonoisa/t5-base-japanese"
-tokenizer = T5Tokenizer.from_pretrained(model_name)
-model = T5ForConditionalGeneration.from_pretrained(model_name)
-model.eval()
-embedding_model = SentenceTransformer('sentence-transformers/paraphrase-multilingual-mpnet-base-v2')
+embedding_model_name = SHARED_EMBEDDING_MODEL or 'sentence-transformers/paraphrase-multilingual-mpnet-base-v2'
+embedding_model = embedding_model_for(embedding_model_name)
+query_model = query_model_for(embedding_model_name)
+# Entries live in data/jp.jsonl and are only parsed when the bot is initialized
+store = KnowledgeStore(os.path.join(DATA_DIR, 'jp.jsonl'))
 kb = None
 chatbot = None
 
-print("✅ モデルの読み込みが完了しました!")
-
 def initialize_bot():
     global kb, chatbot
-    kb = EnhancedBusinessKnowledgeBase(business_data, embedding_model)
+    if PRELOAD_MODELS:
+        query_model.load()
+    kb = EnhancedBusinessKnowledgeBase(store.entries(), embedding_model,
+                                       query_model=query_model,
+                                       batcher=create_batcher(query_model),
+                                       cache=EmbeddingCache(embedding_model_name, 'jp'),
+                                       store=store, language='jp',
+                                       semantic_cache=SemanticCache(),
+                                       tokenizer=get_tokenizer(),
+                                       shared_index=get_shared_index() if SHARED_EMBEDDING_MODEL else None)
+    model, tokenizer = load_generator(model_name)
     chatbot = EnhancedBusinessChatbot(model, tokenizer, kb)
+    warm_image_cache((item.get('image_path') for item in kb.data), 'JPEG')
 
-business_data = [
-    {
-        "question": "ビジュアルアルファは何をする会社ですか？",
-        "answer": "ビジュアルアルファは、東京を拠点とするB2Bフィンテックスタートアップで、機関投資家やアセットマネージャーのデータ運用を革新する包括的なSaaSデータソリューションを提供しています。当社のAI搭載プラットフォームは、複雑なデータ処理を自動化し、自動レポートを生成し、リアルタイムのポートフォリオモニタリング機能を提供します。非構造化金融データを実用的な洞察に変換し、投資チームの手作業によるExcel作業を最大80%削減することを専門としています。当社のソリューションは既存のシステムとシームレスに統合され、大規模な機関投資家のポートフォリオを管理するためのスケーラブルなインフラストラクチャを提供します。",
-        "category": "company_overview",
-        "image_path": "images/company_overview.png",
-        "related_topics": ["サービス", "テクノロジー", "自動化"],
-        "keywords": ["する", "会社", "ビジネス", "について", "概要", "サービス", "ビジュアル", "アルファ", "ビジュアルアルファ", "何をする", "何をする会社", "とは"]
-    },
-    {
-        "question": "ビジュアルアルファの将来の目標は何ですか？",
-        "answer": "ビジュアルアルファは、グローバル企業の顧客基盤を拡大し、データ駆動型ソリューションをより広範な国際的な顧客に提供することを目指しています。世界をリードする組織とのパートナーシップを通じて、グローバル金融エコシステムにおける存在感を強化し、機関投資家の進化するニーズに応えるためのイノベーションを続けていく計画です。",
-        "category": "future_goals",
-        "image_path": "images/future_goals.png",
-        "related_topics": ["グローバル展開", "顧客", "成長", "国際"],
-        "keywords": ["将来", "目標", "拡大", "グローバル", "計画", "ビジョン", "ロードマップ", "今後", "未来", "これから"]
-    },
-    {
-        "question": "ビジュアルアルファはいつ設立されましたか？",
-        "answer": "ビジュアルアルファは、金融セクターのデジタルトランスフォーメーションが著しい時期の2019年12月に東京で設立されました。設立以来、クライアントベースとテクノロジー機能の両面で急速な成長を遂げています。当社は、機関投資運用においてより効率的で透明性が高く、自動化されたソリューションを創造するというビジョンから生まれました。創業者たちは、投資運用とデータシステムにおける豊富な経験を活かし、日本市場における高度なフィンテックソリューションの需要の高まりに対応しています。",
-        "category": "company_history",
-        "image_path": "images/company_timeline.png",
-        "related_topics": ["設立", "成長", "東京"],
-        "keywords": ["設立", "いつ", "創立", "開始", "歴史", "2019", "起源", "創業", "始まった", "スタート"]
-    },
-    {
-        "question": "ビジュアルアルファのチームの規模はどのくらいですか？",
-        "answer": "2025年現在、ビジュアルアルファは取締役、技術顧問、コアスタッフを含め、15-20名程度の高度なスキルを持つプロフェッショナルを雇用しています。当社のチームは、フィンテック、データサイエンス、ソフトウェアエンジニアリング、金融サービスにわたる専門知識を持つ、多様で国際的な視野を持つ従業員で構成されています。世界有数の金融機関、テクノロジー企業、コンサルティング会社での経験を持つチームメンバーと共に、効率的な組織構造を維持しています。当社の文化は、イノベーション、継続的な学習、機関投資家クライアントへの卓越した価値提供を重視しています。",
-        "category": "team_info",
-        "image_path": "images/team_structure.png",
-        "related_topics": ["スタッフ", "専門知識", "企業文化"],
-        "keywords": ["チーム", "スタッフ", "従業員", "人員", "規模", "メンバー", "人数", "どのくらい", "何人", "社員"]
-    },
-    {
-        "question": "ビジュアルアルファのリーダーは誰ですか？",
-        "answer": "ビジュアルアルファは、投資管理データシステムと金融テクノロジーにおける豊富な経験を持つベテランプロフェッショナル、CEOのジェフリー・ツイが率いています。ジェフリーはビジュアルアルファを設立する前に、ステート・ストリート・コーポレーションやウェリントン・マネジメントなどの名門組織で働き、機関投資家がデータ管理とレポーティングにおいて直面する課題について深い洞察を得ました。彼のリーダーシップは、技術的専門知識と戦略的ビジョンを組み合わせ、日本及びそれ以上の地域で機関投資家による金融データの処理と活用を変革するという当社の使命を推進しています。",
-        "category": "leadership",
-        "image_path": "images/leadership_team.png",
-        "related_topics": ["CEO", "経験", "背景"],
-        "keywords": ["CEO", "リーダー", "創業者", "経営陣", "マネジメント", "ジェフリー", "ツイ", "誰", "率いている", "トップ", "代表"]
-    },
-    {
-        "question": "ビジュアルアルファのクライアントには誰がいますか？",
-        "answer": "ビジュアルアルファは、日本の主要なアセットマネージャーや年金基金を含む、名門機関投資家のポートフォリオにサービスを提供しています。注目すべきクライアントには、日本最大級の企業年金基金の一つであるベネッセグループ年金基金、大手資産運用会社の三井住友DSアセットマネジメント、コンサルティングサービスのグローバルリーダーであるマーサージャパンなどがあります。これらの関係は、大規模な機関投資家の厳格な要件を満たすエンタープライズグレードのソリューションを提供する当社の能力を示しており、複雑なポートフォリオ管理、規制報告、データ分析のニーズに対応しています。",
-        "category": "clients",
-        "image_path": "images/client_logos.png",
-        "related_topics": ["機関投資家", "年金基金", "アセットマネージャー"],
-        "keywords": ["クライアント", "顧客", "パートナー", "ベネッセ", "三井住友", "マーサー", "誰", "取引先", "お客様", "企業"]
-    },
-    {
-        "question": "ビジュアルアルファはどのようなテクノロジーを使用していますか？",
-        "answer": "ビジュアルアルファのテクノロジースタックは、高性能な金融データ処理のために設計された最新のスケーラブルなアーキテクチャに基づいて構築されています。バックエンドインフラストラクチャはNodeJSを使用してサーバーサイド開発を行い、高速で効率的なデータ処理を実現しています。フロントエンドはReactで構築され、レスポンシブで直感的なユーザーインターフェースを提供します。特定のWebアプリケーションにはLaravelフレームワークを使用したPHPを使用し、データベース層は信頼性の高いデータストレージのためにMySQLを採用しています。APIアーキテクチャには、柔軟なデータアクセスのためにGraphQLとRESTful APIの両方が含まれています。クラウドインフラストラクチャはAWSを通じて管理され、スケーラビリティとセキュリティを提供し、Dockerコンテナが一貫したデプロイメント環境を保証します。CI/CDパイプラインは、自動テストとデプロイメントのためにCircleCIを使用しています。",
-        "category": "technology",
-        "image_path": "images/tech_stack.png",
-        "related_topics": ["nodejs", "react", "aws", "api"],
-        "keywords": ["テクノロジー", "技術", "スタック", "ツール", "使用", "使っている", "使用している", "nodejs", "react", "aws", "docker", "データベース", "どのような", "どんな", "技術スタック", "テクノロジースタック", "どのようなテクノロジー", "テクノロジーを使用"]
-    },
-    {
-        "question": "ビジュアルアルファの主なサービスは何ですか？",
-        "answer": "ビジュアルアルファは、機関投資家向けに特別に設計された包括的な金融テクノロジーサービスのスイートを提供しています。当社のコアサービスには以下が含まれます：1) 非構造化データ処理 - 複雑な金融文書、レポート、データフィードを構造化された実用的な情報に変換、2) コンテンツ自動化 - 手作業の時間を節約する自動レポート、プレゼンテーション、分析文書の生成、3) パフォーマンス計算 - 正確でリアルタイムのポートフォリオパフォーマンスメトリクスとアトリビューション分析の提供、4) ポートフォリオモニタリング - 投資ポジション、リスクメトリクス、コンプライアンス要件の継続的な追跡。すべてのサービスは、大規模な機関投資を管理する金融専門家向けに調整され、既存の投資管理ワークフローとシームレスに統合されます。",
-        "category": "services",
-        "image_path": "images/services_overview.png",
-        "related_topics": ["データ処理", "自動化", "ポートフォリオ管理"],
-        "keywords": ["サービス", "提供", "製品", "ソリューション", "機能", "能力", "主な", "主要", "コア", "メイン"]
-    },
-    {
-        "question": "マンデートを削除するにはどうすればよいですか？",
-        "answer": "まず、マンデートを削除するには管理者アクセスが必要です。アプリケーションナビゲーションバーから、クライアント→マンデートを削除したいクライアントをクリック→クライアントのマンデート概要ページにリダイレクトされ、そのクライアントに関連付けられているすべてのマンデートのリストが表示されます→削除したいマンデートをクリック→マンデート詳細ページにリダイレクトされます→右上隅の「...」をクリック→開いたリストから「マンデートを削除」をクリックしてください。",
-        "category": "mandate_management",
-        "image_path": "images/delete_mandate.png",
-        "related_topics": ["マンデート", "削除", "管理者", "クライアント管理"],
-        "keywords": ["削除", "マンデート", "除去", "方法", "管理者", "クライアント"]
-    },
-    {
-        "question": "クライアントからマンデートを削除する手順は何ですか？",
-        "answer": "マンデートを削除するには、管理者アクセスが必要です。ナビゲーションバーからクライアントに移動し、特定のクライアントを選択し、すべてのマンデートが表示されるマンデート概要ページを表示し、対象のマンデートをクリックしてマンデート詳細を開き、右上隅の「...」メニューをクリックして、ドロップダウンオプションから「マンデートを削除」を選択します。",
-        "category": "mandate_management",
-        "image_path": "images/delete_mandate.png",
-        "related_topics": ["マンデート", "削除", "管理者", "クライアント管理"],
-        "keywords": ["除去", "マンデート", "削除", "手順", "クライアント", "管理者"]
-    },
-    {
-        "question": "ビジュアルアルファでマンデートを削除するにはどうすればよいですか？",
-        "answer": "マンデートの削除には管理者アクセスが必要です。アプリケーションナビゲーションバーから、クライアントをクリックし、マンデートを削除したいクライアントを選択します。クライアントのマンデート概要ページで、関連するすべてのマンデートが表示されます。削除したいマンデートをクリックしてマンデート詳細ページを開きます。次に、右上隅の「...」メニューボタンをクリックし、オプションから「マンデートを削除」を選択します。",
-        "category": "mandate_management",
-        "image_path": "images/delete_mandate.png",
-        "related_topics": ["マンデート", "削除", "管理者", "クライアント管理"],
-        "keywords": ["削除", "マンデート", "ビジュアルアルファ", "方法", "管理者"]
-    },
-    {
-        "question": "マンデートを削除するにはどのような権限が必要ですか？",
-        "answer": "マンデートを削除するには管理者アクセスが必要です。管理者権限を持っている場合は、クライアント→クライアントを選択→マンデート概要ページを表示→特定のマンデートをクリック→マンデート詳細ページを開く→右上隅の「...」をクリック→ドロップダウンメニューから「マンデートを削除」を選択します。",
-        "category": "mandate_management",
-        "image_path": "images/delete_mandate.png",
-        "related_topics": ["マンデート", "削除", "管理者", "権限"],
-        "keywords": ["権限", "管理者", "削除", "マンデート", "アクセス"]
-    },
-    {
-        "question": "管理者アクセスなしでマンデートを削除できますか？",
-        "answer": "いいえ、管理者アクセスなしではマンデートを削除できません。マンデートの削除には管理者アクセスが必要です。管理者アクセスをお持ちの場合は、次の手順に従ってください：ナビゲーションバーからクライアントをクリック→クライアントを選択→マンデート概要ページに移動→削除するマンデートをクリック→マンデート詳細を開く→右上の「...」をクリック→「マンデートを削除」を選択します。",
-        "category": "mandate_management",
-        "image_path": "images/delete_mandate.png",
-        "related_topics": ["マンデート", "削除", "管理者", "権限"],
-        "keywords": ["管理者", "アクセス", "除去", "マンデート", "権限", "なし"]
-    }
-]
 
 def create_sample_images():
     if not os.path.exists('images'):
@@ -184,58 +100,164 @@ def create_sample_images():
         print(f"🎨 {created_count}個のサンプル画像を作成しました")
 
 class EnhancedBusinessKnowledgeBase:
-    def __init__(self, data, embedding_model):
-        self.data = data
+    def __init__(self, data, embedding_model, batcher=None, cache=None, store=None, query_model=None,
+                 language='jp', shared_index=None, semantic_cache=None, tokenizer=None):
         self.embedding_model = embedding_model
-        self.index = None
-        self.category_index = {}
-        self.keyword_index = {}
-        self.build_index()
+        self.query_model = query_model or embedding_model
+        self.batcher = batcher
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+        self.tokenizer = tokenizer
+        self.store = store
+        self.language = language
+        self.shared_index = shared_index
+        self._write_lock = threading.Lock()
+        # Guards swapping the snapshot; held only for the swap itself, never while taking other locks
+        self._snapshot_lock = threading.Lock()
+        self._snapshot = None
+        self.build_index(data)
+
+    # Searchable state lives in an immutable snapshot that writers swap atomically
+    @property
+    def data(self):
+        return self._snapshot.data
+
+    @property
+    def index(self):
+        return self._snapshot.index
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    @property
+    def category_index(self):
+        return self._snapshot.category_index
+
+    @property
+    def keyword_index(self):
+        return self._snapshot.keyword_index
 
-    def build_index(self):
+    def build_index(self, data=None):
+        data = list(self.data if data is None else data)
+        with self._write_lock:
+            self._install(self._new_snapshot(data))
+
+    def _new_snapshot(self, data):
         # Build semantic embeddings
-        texts = [f"{item['question']} {item['answer']} {' '.join(item.get('related_topics', []))}" 
-                for item in self.data]
-        embeddings = self.embedding_model.encode(texts)
-        dimension = embeddings.shape[1]
-        self.index = faiss.IndexFlatIP(dimension)
+        texts = [entry_text(item) for item in data]
+        if self.shared_index is not None:
+            embeddings = self._embed(texts)
+            index = self._index_builder()(embeddings)
+        elif self.cache is not None:
+            # Reuse embeddings and the built index from disk when the text is unchanged
+            embeddings, index = self.cache.load_or_build(texts, self.embedding_model.encode)
+        else:
+            embeddings = self._embed(texts)
+            index = build_search_index(embeddings)
+        # Category and keyword indices are built alongside the snapshot
+        return KnowledgeSnapshot(data, embeddings, index, tokenizer=self.tokenizer)
+
+    # Other workers may write the same store; their changes are picked up by
+    # rebuilding from the file, and writes start from what is on disk
+    def store_changed(self):
+        return self.store is not None and self.store.changed()
+
+    def refresh(self):
+        """Rebuild from the store if another process changed it; returns whether it did"""
+        with self._write_lock:
+            return self._refresh_locked()
+
+    def _refresh_locked(self):
+        if not self.store_changed():
+            return False
+        self._install(self._new_snapshot(list(self.store.entries())))
+        log.info("reloaded knowledge base changed on disk",
+                 extra=fields(language=self.language, entries=len(self._snapshot.data)))
+        return True
+
+    def _store_locked(self):
+        return self.store.locked() if self.store is not None else contextlib.nullcontext()
+
+    def _index_builder(self):
+        """Index factory for new snapshots: a view of the shared index, or None for a private one"""
+        if self.shared_index is None:
+            return None
+        return lambda embeddings: self.shared_index.publish(self.language, embeddings, self)
+
+    def adopt_index(self, index, embeddings):
+        """Point the current snapshot at a rebuilt shared index if it still holds `embeddings`"""
+        # Called by another language's writer while this one may be writing
+        # too, so the check and the swap happen under the snapshot lock
+        with self._snapshot_lock:
+            snap = self._snapshot
+            if snap is not None and snap.embeddings is embeddings:
+                self._snapshot = snap.with_index(index)
+
+    def _install(self, snapshot):
+        with self._snapshot_lock:
+            self._snapshot = snapshot
+
+    def _embed(self, texts):
+        if self.cache is not None:
+            return self.cache.embed(texts, self.embedding_model.encode)
+        embeddings = np.ascontiguousarray(self.embedding_model.encode(texts), dtype='float32')
         faiss.normalize_L2(embeddings)
-        self.index.add(embeddings.astype('float32'))
-        
-        # Build category index
-        for i, item in enumerate(self.data):
-            category = item.get('category', 'general')
-            if category not in self.category_index:
-                self.category_index[category] = []
-            self.category_index[category].append(i)
-            
-            # Build keyword index for fallback matching
-            keywords = item.get('keywords', [])
-            for keyword in keywords:
-                keyword_lower = keyword.lower()
-                if keyword_lower not in self.keyword_index:
-                    self.keyword_index[keyword_lower] = []
-                self.keyword_index[keyword_lower].append(i)
-
-    def keyword_match(self, query):
+        return embeddings
+
+    def add_entry(self, item):
+        """Embed one new entry and append it to every index; returns its id"""
+        vector = self._embed([entry_text(item)])[0]
+        with self._write_lock, self._store_locked():
+            self._refresh_locked()
+            if self.store is not None:
+                self.store.append(item)
+            self._install(self._snapshot.with_added(item, vector, self._index_builder()))
+            return len(self._snapshot.data) - 1
+
+    def update_entry(self, idx, item):
+        """Replace entry `idx`, re-embedding it only if its text changed"""
+        with self._write_lock, self._store_locked():
+            self._refresh_locked()
+            snap = self._snapshot
+            if entry_text(item) == entry_text(snap.data[idx]):
+                vector = snap.embeddings[idx]
+            else:
+                vector = self._embed([entry_text(item)])[0]
+            if self.store is not None:
+                self.store.replace(idx, item)
+            self._install(snap.with_updated(idx, item, vector, self._index_builder()))
+
+    def delete_entry(self, idx):
+        with self._write_lock, self._store_locked():
+            self._refresh_locked()
+            if self.store is not None:
+                self.store.delete(idx)
+            self._install(self._snapshot.with_deleted(idx, self._index_builder()))
+
+    def keyword_match(self, query, snapshot=None):
         """Fallback keyword matching for better recall"""
+        snap = snapshot or self._snapshot
+        keyword_index = snap.keyword_index
         query_lower = query.lower().strip()
         
-        # Check for exact phrase matches first
+        # Check for exact phrase matches first; the automaton finds them all in one pass
         matches = {}
-        for keyword in self.keyword_index:
-            if keyword in query_lower:
-                for idx in self.keyword_index[keyword]:
-                    # Give higher weight to phrase matches
-                    weight = len(keyword.split())
-                    matches[idx] = matches.get(idx, 0) + weight
-        
-        # Also check individual words (for Japanese, check characters)
-        query_words = re.findall(r'\w+', query_lower)
+        for keyword in snap.keyword_automaton.find(query_lower):
+            for idx in keyword_index[keyword]:
+                # Give higher weight to phrase matches
+                weight = len(keyword.split())
+                matches[idx] = matches.get(idx, 0) + weight
+        
+        # Also check individual words. With a tokenizer the query is split the
+        # same way as the keywords, so unspaced Japanese is probed token by token
+        if snap.keyword_tokens is not None:
+            query_words = snap.keyword_tokens.match(snap.tokenizer(query_lower))
+        else:
+            query_words = [w for w in re.findall(r'\w+', query_lower) if w in keyword_index]
         for word in query_words:
-            if word in self.keyword_index:
-                for idx in self.keyword_index[word]:
-                    matches[idx] = matches.get(idx, 0) + 0.5
+            for idx in keyword_index[word]:
+                matches[idx] = matches.get(idx, 0) + 0.5
         
         # Return indices sorted by match count
         if matches:
@@ -243,74 +265,174 @@ class EnhancedBusinessKnowledgeBase:
             return [idx for idx, count in sorted_matches if count >= 1]
         return []
 
-    def search(self, query, top_k=2, min_score=0.30):
-        """Hybrid search: semantic + keyword matching"""
-        query_lower = query.lower().strip()
-        
-        # First try keyword matching for better precision on specific queries
-        keyword_matches = self.keyword_match(query)
-        
-        # Debug: Print keyword matches
-        if keyword_matches:
-            print(f"🔍 Keyword matches found: {[self.data[idx]['question'][:50] for idx in keyword_matches[:3]]}")
-        
-        # Semantic search
-        query_embedding = self.embedding_model.encode([query])
+    def embed_query(self, query):
+        """Normalized (1, dim) query embedding, micro-batched when a batcher is set"""
+        with timed('embed', self.language):
+            if self.batcher is not None:
+                return self.batcher.embed(query)
+            query_embedding = np.ascontiguousarray(self.query_model.encode([query]), dtype='float32')
+            faiss.normalize_L2(query_embedding)
+            return query_embedding
+
+    def embed_and_search(self, query, top_k, index=None):
+        """Query embedding plus index search hits, one micro-batched round-trip when a batcher is set"""
+        if index is None:
+            index = self._snapshot.searcher
+        if self.batcher is not None:
+            return self.batcher.embed_and_search(index, query, top_k)
+        query_embedding = np.ascontiguousarray(self.query_model.encode([query]), dtype='float32')
         faiss.normalize_L2(query_embedding)
-        scores, indices = self.index.search(query_embedding.astype('float32'), top_k)
+        scores, indices = index.search(query_embedding, top_k)
+        return query_embedding, scores, indices
 
-        # Debug: Print semantic matches
-        print(f"🔍 Semantic matches: {[(self.data[idx]['question'][:50], float(scores[0][i])) for i, idx in enumerate(indices[0])]}")
+    def lexical_search(self, query, top_k, snapshot=None):
+        """BM25 over question + answer text, tokenized like the keyword index"""
+        return (snapshot or self._snapshot).bm25.search(query, top_k)
 
-        results = []
-        
-        # If we have a strong keyword match, prioritize it
-        if keyword_matches:
-            idx = keyword_matches[0]
-            # Check if this is also in semantic results
-            if idx in indices[0]:
-                sem_idx = list(indices[0]).index(idx)
-                score = float(scores[0][sem_idx])
-            else:
-                score = 0.6  # Give good score to keyword matches
-            
-            print(f"✅ Using keyword match: {self.data[idx]['question'][:60]}")
-            
-            results.append({
-                'text': self.data[idx]['answer'],
-                'score': score,
-                'question': self.data[idx]['question'],
-                'category': self.data[idx].get('category', 'general'),
-                'image_path': self.data[idx].get('image_path'),
-                'related_topics': self.data[idx].get('related_topics', []),
-                'match_type': 'keyword'
-            })
+    def search(self, query, top_k=2, min_score=0.30):
+        """Hybrid search: keyword, BM25 and semantic rankings fused by reciprocal rank"""
+        # Capture one snapshot so concurrent updates cannot shift entry ids mid-search
+        snap = self._snapshot
+        data = snap.data
+
+        # Lexical retrieval first; it needs no embedding
+        with timed('keyword_match', self.language):
+            keyword_matches = self.keyword_match(query, snap)
+        with timed('bm25', self.language):
+            lex_scores, lex_indices = self.lexical_search(query, HYBRID_CANDIDATES, snap)
+
+        # Debug: Log keyword matches
+        if keyword_matches and log.isEnabledFor(logging.DEBUG):
+            log.debug("keyword matches", extra=fields(
+                query=query, questions=[data[idx]['question'][:50] for idx in keyword_matches[:3]]))
+
+        # When keywords and BM25 agree on a clear winner, skip the encoder entirely
+        if lexical_is_decisive(keyword_matches, lex_scores, lex_indices):
+            log.debug("keyword match", extra=fields(query=query, question=data[keyword_matches[0]]['question'][:60]))
+            return [self._result(snap, keyword_matches[0], KEYWORD_MATCH_SCORE, 'keyword')]
+
+        # Embedding and semantic search share one micro-batched round-trip
+        with timed('embed_search', self.language):
+            query_embedding, scores, indices = self.embed_and_search(
+                query, max(top_k, HYBRID_CANDIDATES), snap.searcher)
+
+        # Near-duplicates of a recent query reuse its fused results
+        if self.semantic_cache is not None:
+            with timed('semantic_cache', self.language):
+                cached = self.semantic_cache.lookup(query_embedding, snap.version, (top_k, min_score))
+            if cached is not None:
+                log.debug("semantic cache hit", extra=fields(
+                    query=query, question=cached[0]['question'][:60] if cached else None))
+                return list(cached)
+
+        results = self._fuse(snap, query, top_k, min_score, keyword_matches, lex_indices, scores, indices)
+        if self.semantic_cache is not None:
+            self.semantic_cache.store(query_embedding, snap.version, results, (top_k, min_score))
+        return results
+
+    def search_batch(self, queries, top_k=2, min_score=0.30):
+        """Hybrid search for many queries, in order; one encoder call and one index search for the batch"""
+        snap = self._snapshot
+        results = [None] * len(queries)
+
+        # Queries the lexical rankings settle never reach the encoder
+        lexical = {}
+        with timed('batch_lexical', self.language):
+            for i, query in enumerate(queries):
+                keyword_matches = self.keyword_match(query, snap)
+                lex_scores, lex_indices = self.lexical_search(query, HYBRID_CANDIDATES, snap)
+                if lexical_is_decisive(keyword_matches, lex_scores, lex_indices):
+                    results[i] = [self._result(snap, keyword_matches[0], KEYWORD_MATCH_SCORE, 'keyword')]
+                else:
+                    lexical[i] = (keyword_matches, lex_indices)
+        if not lexical:
             return results
-        
-        # Otherwise use semantic results
-        for idx, score in zip(indices[0], scores[0]):
-            if score > min_score:
-                results.append({
-                    'text': self.data[idx]['answer'],
-                    'score': float(score),
-                    'question': self.data[idx]['question'],
-                    'category': self.data[idx].get('category', 'general'),
-                    'image_path': self.data[idx].get('image_path'),
-                    'related_topics': self.data[idx].get('related_topics', []),
-                    'match_type': 'semantic'
-                })
-        
+
+        # The rest are encoded together
+        pending = list(lexical)
+        with timed('batch_embed', self.language):
+            embeddings = np.ascontiguousarray(self.query_model.encode([queries[i] for i in pending]), dtype='float32')
+            faiss.normalize_L2(embeddings)
+        rows = []
+        for row, i in enumerate(pending):
+            if self.semantic_cache is not None:
+                cached = self.semantic_cache.lookup(embeddings[row:row + 1], snap.version, (top_k, min_score))
+                if cached is not None:
+                    results[i] = list(cached)
+                    continue
+            rows.append(row)
+        if not rows:
+            return results
+
+        # ...and searched together
+        with timed('batch_faiss_search', self.language):
+            scores, indices = snap.searcher.search(embeddings[rows], max(top_k, HYBRID_CANDIDATES))
+        for n, row in enumerate(rows):
+            i = pending[row]
+            keyword_matches, lex_indices = lexical[i]
+            results[i] = self._rank(snap, top_k, min_score, keyword_matches, lex_indices,
+                                    scores[n:n + 1], indices[n:n + 1])
+            if self.semantic_cache is not None:
+                self.semantic_cache.store(embeddings[row:row + 1], snap.version, results[i], (top_k, min_score))
+        return results
+
+    def _fuse(self, snap, query, top_k, min_score, keyword_matches, lex_indices, scores, indices):
+        data = snap.data
+
+        # Debug: Log semantic matches
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("semantic matches", extra=fields(query=query, matches=[
+                (data[idx]['question'][:50], float(scores[0][i])) for i, idx in enumerate(indices[0][:top_k]) if idx >= 0]))
+
+        results = self._rank(snap, top_k, min_score, keyword_matches, lex_indices, scores, indices)
         if results:
-            print(f"✅ Using semantic match: {results[0]['question'][:60]}")
-        
+            log.debug("hybrid match", extra=fields(
+                query=query, match_type=results[0]['match_type'], question=results[0]['question'][:60]))
+
+        return results
+
+    def _rank(self, snap, top_k, min_score, keyword_matches, lex_indices, scores, indices):
+        """Rank the candidate pool by fused rank; scores stay cosine similarities"""
+        semantic = {int(idx): float(score) for idx, score in zip(indices[0], scores[0]) if idx >= 0}
+        lexical = set(ranked_ids(lex_indices))
+        keywords = set(keyword_matches)
+
+        results = []
+        for idx in reciprocal_rank_fusion([keyword_matches[:HYBRID_CANDIDATES], ranked_ids(lex_indices),
+                                           ranked_ids(indices)]):
+            # Every result must clear min_score
+            if semantic.get(idx, 0.0) > min_score:
+                match_type = 'keyword' if idx in keywords else 'hybrid' if idx in lexical else 'semantic'
+                results.append(self._result(snap, idx, semantic[idx], match_type))
+            if len(results) == top_k:
+                break
+
+        # The top keyword hit is only a fallback when nothing clears min_score,
+        # so a short, common keyword alone cannot surface unrelated entries
+        if not results and keyword_matches:
+            idx = keyword_matches[0]
+            results.append(self._result(snap, idx, semantic.get(idx, KEYWORD_MATCH_SCORE), 'keyword'))
         return results
 
+    def _result(self, snap, idx, score, match_type):
+        item = snap.data[idx]
+        return {
+            'text': item['answer'],
+            'score': score,
+            'question': item['question'],
+            'category': item.get('category', 'general'),
+            'image_path': item.get('image_path'),
+            'related_topics': item.get('related_topics', []),
+            'match_type': match_type
+        }
+
     def get_related_content(self, category, exclude_idx=None):
-        if category in self.category_index:
+        snap = self._snapshot
+        if category in snap.category_index:
             related = []
-            for idx in self.category_index[category]:
+            for idx in snap.category_index[category]:
                 if exclude_idx is None or idx != exclude_idx:
-                    related.append(self.data[idx])
+                    related.append(snap.data[idx])
             return related[:2]
         return []
 
@@ -342,8 +464,8 @@ class EnhancedBusinessKnowledgeBase:
                 'image_path': best_match.get('image_path'),
                 'category': best_match.get('category', 'general')
             }
-        except Exception as e:
-            print(f"Error in get_response: {str(e)}")
+        except Exception:
+            log.exception("get_response failed", extra=fields(query=query))
             return {
                 'answer': 'すみません、エラーが発生しました。',
                 'confidence': '低',
@@ -357,7 +479,7 @@ class EnhancedBusinessChatbot:
         self.tokenizer = tokenizer
         self.kb = knowledge_base
         self.knowledge_base = knowledge_base  # For backward compatibility
-        self.conversation_history = []
+        self.conversation_history = conversation_history()
         
         # Configuration
         self.confidence_threshold = 0.30
@@ -408,7 +530,17 @@ class EnhancedBusinessChatbot:
             return self._handle_out_of_context("Empty query")
         
         relevant_docs = self.kb.search(user_query, top_k=2, min_score=self.confidence_threshold)
-        
+        return self._respond(user_query, relevant_docs)
+
+    def generate_batch(self, user_queries) -> List[Tuple[str, Optional[str], List[str]]]:
+        """generate_detailed_response for many queries, searched together"""
+        queries = [q.strip() for q in user_queries]
+        searched = iter(self.kb.search_batch([q for q in queries if q], top_k=2,
+                                             min_score=self.confidence_threshold) if any(queries) else [])
+        return [self._respond(q, next(searched)) if q else self._handle_out_of_context("Empty query")
+                for q in queries]
+
+    def _respond(self, user_query, relevant_docs) -> Tuple[str, Optional[str], List[str]]:
         if not relevant_docs:
             return self._handle_out_of_context(user_query)
         
@@ -453,68 +585,95 @@ class EnhancedBusinessChatbot:
         
         return response, None, []
 
-    def get_response(self, query: str) -> Dict:
+    def get_response(self, query: str, image_mode: str = 'base64') -> Dict:
         """Main response method with backward compatibility"""
         try:
-            print(f"Processing query in chatbot: {query}")
-            
-            response, image_path, related_topics = self.generate_detailed_response(query)
+            log.debug("processing query", extra=fields(query=query))
             
-            image_base64 = None
-            if image_path:
-                try:
-                    # Try relative path first
-                    if os.path.exists(image_path):
-                        img_path_to_use = image_path
-                    else:
-                        # Try parent directory path
-                        img_path_to_use = os.path.join(os.path.dirname(os.path.dirname(__file__)), image_path)
-                    
-                    if os.path.exists(img_path_to_use):
-                        with Image.open(img_path_to_use) as img:
-                            if img.mode == 'RGBA':
-                                img = img.convert('RGB')
-                            
-                            img_byte_arr = io.BytesIO()
-                            img.save(img_byte_arr, format='JPEG')
-                            img_byte_arr = img_byte_arr.getvalue()
-                            
-                            image_base64 = base64.b64encode(img_byte_arr).decode('utf-8')
-                    else:
-                        print(f"画像が見つかりません: {image_path}")
-                except Exception as e:
-                    print(f"画像の読み込みエラー: {str(e)}")
-
-            # Determine confidence based on image availability and response content
-            if image_path and image_base64:
-                confidence = '高'
-            elif "その情報は持っていません" in response:
-                confidence = '低'
-            else:
-                confidence = '中'
+            return self._with_image(*self.generate_detailed_response(query), image_mode)
+        except Exception:
+            log.exception("chatbot response failed", extra=fields(query=query))
+            return self._error_response()
 
-            return {
-                'response': response,
-                'image_base64': image_base64,
-                'confidence': confidence,
-                'related_topics': related_topics
-            }
-        except Exception as e:
-            print(f"Error in chatbot response: {str(e)}")
-            return {
-                'response': 'すみません、エラーが発生しました。',
-                'image_base64': None,
-                'confidence': '低',
-                'related_topics': []
-            }
+    def get_batch_responses(self, queries, image_mode: str = 'base64') -> List[Dict]:
+        """get_response for many queries in order; an image failure only fails its own item"""
+        responses = []
+        for query, answer in zip(queries, self.generate_batch(queries)):
+            try:
+                responses.append(self._with_image(*answer, image_mode))
+            except Exception:
+                log.exception("chatbot response failed", extra=fields(query=query))
+                responses.append(self._error_response())
+        return responses
+
+    def _with_image(self, response, image_path, related_topics, image_mode) -> Dict:
+        image = self.get_image(image_path, image_mode)
+        return {
+            'response': response,
+            'image_base64': image['image_base64'],
+            'image_url': image['image_url'],
+            'confidence': self._confidence(response, image_path and (image['image_base64'] or image['image_url'])),
+            'related_topics': related_topics
+        }
+
+    def _error_response(self) -> Dict:
+        return {
+            'response': 'すみません、エラーが発生しました。',
+            'image_base64': None,
+            'confidence': '低',
+            'related_topics': [],
+            'error': True
+        }
+
+    def get_answer(self, query: str) -> Dict:
+        """Answer text and topics without the image (used for streaming)
+
+        Confidence depends on whether the image can be delivered, so it is
+        computed by chat_confidence once get_image has run.
+        """
+        log.debug("processing query", extra=fields(query=query))
+        response, image_path, related_topics = self.generate_detailed_response(query)
+        return {
+            'response': response,
+            'image_path': image_path,
+            'related_topics': related_topics
+        }
+
+    def get_image(self, image_path: Optional[str], image_mode: str = 'base64') -> Dict:
+        """Image for an answer: a URL in url mode when the API can serve it, otherwise base64"""
+        image_base64 = None
+        # In URL mode, images the API can serve are linked instead of inlined
+        url = image_url(image_path) if image_path and image_mode == 'url' else None
+        if image_path and not url:
+            try:
+                # JPEG payloads are cached per path + mtime, so each image is encoded once
+                with timed('image_encode', 'jp'):
+                    image_base64 = file_base64(self._image_file(image_path), 'JPEG')
+                if image_base64 is None:
+                    log.warning("image not found", extra=fields(path=image_path))
+            except Exception as e:
+                log.warning("image load failed", extra=fields(path=image_path, error=str(e)))
+        return {'image_base64': image_base64, 'image_url': url}
+
+    def _image_file(self, image_path: str) -> str:
+        # Try relative path first, then the parent directory
+        if os.path.exists(image_path):
+            return image_path
+        return os.path.join(os.path.dirname(os.path.dirname(__file__)), image_path)
+
+    def _confidence(self, response: str, has_image) -> str:
+        """Confidence based on image availability and response content"""
+        if has_image:
+            return '高'
+        if "その情報は持っていません" in response:
+            return '低'
+        return '中'
 
 def encode_image_to_base64(image_path):
     try:
-        if os.path.exists(image_path):
-            with open(image_path, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
+        return file_base64(image_path)
     except Exception as e:
-        print(f"画像のエンコードエラー: {e}")
+        log.warning("image encoding failed", extra=fields(path=image_path, error=str(e)))
     return None
 
 def create_placeholder_image(text="Visual Alpha", size=(400, 200)):
@@ -535,33 +694,68 @@ def create_placeholder_image(text="Visual Alpha", size=(400, 200)):
     draw.text((x, y), text, fill='white', font=font)
     return img
 
-def enhanced_chat_response(message: str) -> dict:
+def enhanced_chat_response(message: str, image_mode: str = 'base64') -> dict:
     """Main entry point for chat responses"""
     if chatbot is None:
         return {
             "response": "チャットボットが初期化されていません。",
             "image_base64": None,
             "confidence": "低",
-            "related_topics": []
+            "related_topics": [],
+            "error": True
         }
     
     try:
-        result = chatbot.get_response(message)
+        result = chatbot.get_response(message, image_mode)
         return {
             "response": result['response'],
             "image_base64": result.get('image_base64'),
+            "image_url": result.get('image_url'),
             "confidence": result.get('confidence', '低'),
-            "related_topics": result.get('related_topics', [])
+            "related_topics": result.get('related_topics', []),
+            "error": result.get('error', False)
         }
-    except Exception as e:
-        print(f"Error in enhanced_chat_response: {str(e)}")
+    except Exception:
+        log.exception("enhanced_chat_response failed", extra=fields(query=message))
         return {
             "response": "申し訳ありませんが、エラーが発生しました。",
             "image_base64": None,
             "confidence": "低",
-            "related_topics": []
+            "related_topics": [],
+            "error": True
         }
 
+def batch_chat_response(messages, image_mode: str = 'base64') -> list:
+    """enhanced_chat_response for many messages, in order, retrieved as one batch"""
+    if chatbot is None:
+        raise ValueError("チャットボットが初期化されていません。")
+    return [{
+        "response": result['response'],
+        "image_base64": result.get('image_base64'),
+        "image_url": result.get('image_url'),
+        "confidence": result.get('confidence', '低'),
+        "related_topics": result.get('related_topics', []),
+        "error": result.get('error', False)
+    } for result in chatbot.get_batch_responses(messages, image_mode)]
+
+def chat_answer(message: str) -> dict:
+    """Retrieval half of a chat response, for streaming: text and topics"""
+    if chatbot is None:
+        raise ValueError("チャットボットが初期化されていません。")
+    return chatbot.get_answer(message)
+
+def chat_confidence(answer: dict, image: dict) -> str:
+    """Confidence of a streamed answer once its image (or its absence) is known"""
+    if chatbot is None:
+        raise ValueError("チャットボットが初期化されていません。")
+    return chatbot._confidence(answer['response'], answer['image_path'] and (image['image_base64'] or image['image_url']))
+
+def chat_image(image_path, related_topics, image_mode: str = 'base64') -> dict:
+    """Image half of a chat response, sent after the answer when streaming"""
+    if chatbot is None:
+        raise ValueError("チャットボットが初期化されていません。")
+    return chatbot.get_image(image_path, image_mode)
+
 def interactive_mode():
     print("\n🤖 インタラクティブチャットモード（終了するには'quit'と入力）")
     print("ビジュアルアルファについて何でも質問してください！")
@@ -606,20 +800,23 @@ def interactive_mode():
         except Exception as e:
             print(f"❌ エラー: {e}")
 
+# The first eight are in-context questions, the rest should be declined
+TEST_QUESTIONS = [
+    "ビジュアルアルファは何をする会社ですか？",
+    "ビジュアルアルファとは",
+    "テクノロジースタックについて教えてください", 
+    "リーダーは誰ですか？",
+    "主なサービスは何ですか？",
+    "チームについて教えてください",
+    "いつ設立されましたか？",
+    "クライアントは誰ですか？",
+    "今日の天気は？",
+    "総理大臣は誰ですか？",
+    "ピザの作り方は？",
+]
+
 def run_tests():
-    test_questions = [
-        "ビジュアルアルファは何をする会社ですか？",
-        "ビジュアルアルファとは",
-        "テクノロジースタックについて教えてください", 
-        "リーダーは誰ですか？",
-        "主なサービスは何ですか？",
-        "チームについて教えてください",
-        "いつ設立されましたか？",
-        "クライアントは誰ですか？",
-        "今日の天気は？",
-        "総理大臣は誰ですか？",
-        "ピザの作り方は？",
-    ]
+    test_questions = TEST_QUESTIONS
     
     print("\n🧪 拡張チャットボットをテスト中:")
     print("=" * 50)
@@ -688,8 +885,7 @@ if __name__ == "__main__":
     try:
         print("\n🤖 チャットボットを初期化中...")
         create_sample_images()
-        kb = EnhancedBusinessKnowledgeBase(business_data, embedding_model)
-        chatbot = EnhancedBusinessChatbot(model, tokenizer, kb)
+        initialize_bot()
         print("✅ チャットの準備ができました！")
         
         # コメントを外して使用してください:
@@ -0,0 +1,320 @@
+import os
+import math
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+# Index type for knowledge base embeddings: "flat" (exact), "hnsw",
+# "ivf_flat", "ivf_pq", or any faiss.index_factory string such as
+# "IVF4096,PQ48". Approximate types only kick in from FAISS_ANN_MIN_SIZE
+# vectors; below that exact search is both faster and lossless.
+FAISS_INDEX = os.getenv("FAISS_INDEX", "flat")
+FAISS_ANN_MIN_SIZE = int(os.getenv("FAISS_ANN_MIN_SIZE", "10000"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "80"))
+FAISS_HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+# 0 picks 4 * sqrt(n) inverted lists.
+FAISS_IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", "0"))
+FAISS_IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", "16"))
+# 0 picks the largest of 64/48/32/24/16/8 sub-quantizers dividing the dimension.
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "0"))
+FAISS_PQ_NBITS = int(os.getenv("FAISS_PQ_NBITS", "8"))
+# Training (IVF centroids, PQ codebooks) uses at most this many sampled vectors.
+FAISS_TRAIN_SIZE = int(os.getenv("FAISS_TRAIN_SIZE", "100000"))
+# How flat, HNSW and IVF indices store vectors: "float32", "float16" or
+# "int8" (FAISS scalar quantizers, 2x / 4x smaller). Lossy indices are
+# searched for FAISS_RESCORE_FACTOR x k candidates which are then re-ranked
+# with the float32 embedding matrix.
+FAISS_STORAGE = os.getenv("FAISS_STORAGE", "float32")
+FAISS_RESCORE_FACTOR = int(os.getenv("FAISS_RESCORE_FACTOR", "4"))
+# Map cached index files read-only instead of loading them, so worker
+# processes started separately share one copy in the page cache.
+FAISS_MMAP = os.getenv("FAISS_MMAP", "0") == "1"
+# HNSW and IVF indices absorb entry updates and deletes in place; once more
+# than this fraction of their entries has changed since they were built, the
+# next change rebuilds (and retrains) them from the embeddings instead.
+FAISS_REBUILD_FRACTION = float(os.getenv("FAISS_REBUILD_FRACTION", "0.1"))
+
+_CODECS = {'float32': 'Flat', 'float16': 'SQfp16', 'int8': 'SQ8'}
+
+
+def build_flat_index(embeddings: np.ndarray) -> faiss.Index:
+    index = faiss.IndexFlatIP(embeddings.shape[1])
+    index.add(np.ascontiguousarray(embeddings, dtype='float32'))
+    return index
+
+
+def _pq_m(dim: int) -> int:
+    if FAISS_PQ_M:
+        return FAISS_PQ_M
+    return next((m for m in (64, 48, 32, 24, 16, 8) if dim % m == 0), 1)
+
+
+def index_spec(n: int, dim: int, kind: str = FAISS_INDEX, storage: str = FAISS_STORAGE,
+               min_size: int = FAISS_ANN_MIN_SIZE) -> str:
+    """The faiss.index_factory string used for `n` vectors of `dim` dimensions."""
+    codec = _CODECS[storage]
+    if kind == 'flat' or n < min_size:
+        return codec
+    # faiss wants roughly 39 training points per inverted list.
+    train = min(n, FAISS_TRAIN_SIZE)
+    nlist = max(1, min(FAISS_IVF_NLIST or int(4 * math.sqrt(n)), train // 39))
+    if kind == 'hnsw':
+        return f'HNSW{FAISS_HNSW_M},{codec}'
+    if kind == 'ivf_flat':
+        return f'IVF{nlist},{codec}'
+    if kind == 'ivf_pq':
+        # Each sub-quantizer trains 2**nbits centroids and needs at least that many points.
+        nbits = min(FAISS_PQ_NBITS, int(math.log2(train)) if train else 0)
+        if nbits < 1:
+            return codec
+        return f'IVF{nlist},PQ{_pq_m(dim)}x{nbits}'
+    return kind
+
+
+def configure_search(index: faiss.Index, ef_search: Optional[int] = None,
+                     nprobe: Optional[int] = None) -> faiss.Index:
+    """Apply efSearch / nprobe to an index built or read from disk."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe or FAISS_IVF_NPROBE, ivf.nlist)
+    inner = faiss.downcast_index(index)
+    if hasattr(inner, 'hnsw'):
+        inner.hnsw.efSearch = ef_search or FAISS_HNSW_EF_SEARCH
+    return index
+
+
+def build_search_index(embeddings: np.ndarray, kind: str = FAISS_INDEX, storage: str = FAISS_STORAGE,
+                       min_size: int = FAISS_ANN_MIN_SIZE) -> faiss.Index:
+    """Train (if needed) and fill an inner-product index of the configured type."""
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    n, dim = embeddings.shape
+    spec = index_spec(n, dim, kind, storage, min_size)
+    if spec == 'Flat':
+        return build_flat_index(embeddings)
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+    inner = faiss.downcast_index(index)
+    if hasattr(inner, 'hnsw'):
+        inner.hnsw.efConstruction = FAISS_HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        train = embeddings
+        if n > FAISS_TRAIN_SIZE:
+            rows = np.random.default_rng(0).choice(n, FAISS_TRAIN_SIZE, replace=False)
+            train = embeddings[np.sort(rows)]
+        index.train(train)
+    index.add(embeddings)
+    return configure_search(index)
+
+
+def read_index(path: str) -> faiss.Index:
+    """Read an index file, memory-mapped when FAISS_MMAP is set, ready to search."""
+    return configure_search(faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC if FAISS_MMAP else 0))
+
+
+def copy_index(index: faiss.Index) -> faiss.Index:
+    """A writable copy of `index`.
+
+    clone_index of a memory-mapped index still points into the file and
+    aborts on `add`, so those are copied through a serialized buffer.
+    """
+    if FAISS_MMAP:
+        return faiss.deserialize_index(faiss.serialize_index(index))
+    return faiss.clone_index(index)
+
+
+def search_parameters(index: faiss.Index, selector: faiss.IDSelector) -> faiss.SearchParameters:
+    """SearchParameters of the type `index` expects, restricted to `selector`."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    inner = faiss.downcast_index(index)
+    if hasattr(inner, 'hnsw'):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def is_lossy(index: faiss.Index) -> bool:
+    """Whether `index` scores with compressed vectors rather than the float32 originals."""
+    inner = faiss.downcast_index(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return not isinstance(faiss.downcast_index(inner.storage), faiss.IndexFlat)
+    if isinstance(inner, faiss.IndexIVF):
+        return not isinstance(inner, faiss.IndexIVFFlat)
+    return not isinstance(inner, faiss.IndexFlat)
+
+
+class RescoringIndex:
+    """A lossy index whose top candidates are re-ranked with float32 vectors.
+
+    `embeddings` is usually the embedding cache's memory-mapped matrix, so
+    only the rows of candidates are paged in.
+    """
+
+    def __init__(self, index, embeddings: np.ndarray, factor: int = FAISS_RESCORE_FACTOR):
+        self.index = index
+        self.embeddings = embeddings
+        self.factor = factor
+        self.ntotal = index.ntotal
+
+    def search(self, x: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        _, candidates = self.index.search(x, k * self.factor)
+        scores = np.full((len(x), k), -np.finfo('float32').max, dtype='float32')
+        ids = np.full((len(x), k), -1, dtype='int64')
+        for row, found in enumerate(candidates):
+            found = found[found >= 0]
+            if not len(found):
+                continue
+            exact = np.asarray(self.embeddings[np.sort(found)], dtype='float32') @ x[row]
+            order = np.argsort(-exact, kind='stable')[:k]
+            scores[row, :len(order)] = exact[order]
+            ids[row, :len(order)] = np.sort(found)[order]
+        return scores, ids
+
+
+class MutableIndex:
+    """An HNSW or IVF index edited by entry updates and deletes instead of retrained.
+
+    Vectors are stored under slot ids that never move, and `positions` maps
+    each slot to its entry id (-1 once the entry was replaced or deleted),
+    so deleting an entry renumbers the later ones without touching the index.
+    IVF drops dead slots with `remove_ids`; HNSW cannot remove vectors from
+    its graph, so its dead slots stay as tombstones excluded at search time.
+    Every edit returns a new object over a copy, like the snapshots holding it.
+    """
+
+    def __init__(self, index: faiss.Index, positions: Optional[np.ndarray] = None,
+                 dead: Optional[np.ndarray] = None, churn: int = 0):
+        self.index = index
+        self.positions = np.arange(index.ntotal, dtype='int64') if positions is None else positions
+        self.dead = np.zeros(0, dtype='int64') if dead is None else dead
+        # Updates and deletes since the index was built.
+        self.churn = churn
+        self.ntotal = int(np.count_nonzero(self.positions >= 0))
+        self._ivf = faiss.try_extract_index_ivf(index) is not None
+        self._params = None
+        if len(self.dead):
+            self._excluded = faiss.IDSelectorBatch(self.dead)
+            self._params = search_parameters(index, faiss.IDSelectorNot(self._excluded))
+
+    @staticmethod
+    def supports(index) -> bool:
+        return (isinstance(index, MutableIndex) or faiss.try_extract_index_ivf(index) is not None
+                or hasattr(faiss.downcast_index(index), 'hnsw'))
+
+    def search(self, x: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores, slots = self.index.search(x, k, params=self._params)
+        return scores, np.where(slots >= 0, self.positions[np.maximum(slots, 0)], -1)
+
+    def needs_rebuild(self) -> bool:
+        return self.churn > FAISS_REBUILD_FRACTION * max(1, self.ntotal)
+
+    def with_added(self, vector: np.ndarray) -> 'MutableIndex':
+        index = copy_index(self.index)
+        self._add(index, vector)
+        return MutableIndex(index, np.append(self.positions, self.ntotal), self.dead, self.churn)
+
+    def with_updated(self, idx: int, vector: np.ndarray) -> 'MutableIndex':
+        index = copy_index(self.index)
+        positions, dead = self._drop(index, idx)
+        self._add(index, vector)
+        return MutableIndex(index, np.append(positions, idx), dead, self.churn + 1)
+
+    def with_deleted(self, idx: int) -> 'MutableIndex':
+        index = copy_index(self.index)
+        positions, dead = self._drop(index, idx)
+        positions[positions > idx] -= 1
+        return MutableIndex(index, positions, dead, self.churn + 1)
+
+    def _add(self, index: faiss.Index, vector: np.ndarray):
+        x = np.ascontiguousarray(vector.reshape(1, -1), dtype='float32')
+        if self._ivf:
+            index.add_with_ids(x, np.array([len(self.positions)], dtype='int64'))
+        else:
+            # HNSW numbers vectors in insertion order and never removes any,
+            # so the new vector's id is the next slot.
+            index.add(x)
+
+    def _drop(self, index: faiss.Index, idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        slot = int(np.flatnonzero(self.positions == idx)[0])
+        positions = self.positions.copy()
+        positions[slot] = -1
+        if self._ivf:
+            index.remove_ids(np.array([slot], dtype='int64'))
+            return positions, self.dead
+        return positions, np.append(self.dead, slot)
+
+
+def recall_report(corpus: np.ndarray, queries: np.ndarray, k: int = 10,
+                  configs: Sequence[Dict] = ()) -> List[Dict]:
+    """recall@k, top-1 agreement, latency and size of each config against exact search.
+
+    Each config is `{'kind': ..., 'storage': ..., 'ef_search': ..., 'nprobe': ...,
+    'rescore': bool}`; the float32 flat index supplies the ground truth and
+    the first row of the report.
+    """
+    flat = build_flat_index(corpus)
+    start = time.perf_counter()
+    _, truth = flat.search(queries, k)
+    flat_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    rows = [{'index': 'Flat', 'recall': 1.0, 'top1': 1.0, 'ms_per_query': flat_ms, 'build_s': 0.0,
+             'index_mb': _index_mb(flat)}]
+
+    built: Dict[str, faiss.Index] = {}
+    for config in configs:
+        storage = config.get('storage', 'float32')
+        spec = index_spec(len(corpus), corpus.shape[1], config['kind'], storage)
+        if spec not in built:
+            start = time.perf_counter()
+            built[spec] = build_search_index(corpus, config['kind'], storage)
+            build_s = time.perf_counter() - start
+        else:
+            build_s = 0.0
+        index = configure_search(built[spec], config.get('ef_search'), config.get('nprobe'))
+        searcher = RescoringIndex(index, corpus) if config.get('rescore') else index
+        start = time.perf_counter()
+        _, found = searcher.search(queries, k)
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+        hits = sum(len(set(found[i]) & set(truth[i])) for i in range(len(queries)))
+        label = spec + ''.join(f" {key}={config[key]}" for key in ('ef_search', 'nprobe') if key in config)
+        if config.get('rescore'):
+            label += ' +rescore'
+        rows.append({'index': label, 'recall': hits / truth.size,
+                     'top1': float(np.mean(found[:, 0] == truth[:, 0])),
+                     'ms_per_query': ms, 'build_s': build_s, 'index_mb': _index_mb(index)})
+    return rows
+
+
+def _index_mb(index: faiss.Index) -> float:
+    return faiss.serialize_index(index).nbytes / 2 ** 20
+
+
+def _clustered(n: int, dim: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    centers = rng.standard_normal((clusters, dim)).astype('float32')
+    x = centers[rng.integers(0, clusters, n)] + 0.5 * rng.standard_normal((n, dim)).astype('float32')
+    faiss.normalize_L2(x)
+    return x
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Synthetic clustered unit vectors stand in for a large article corpus:
+    #   python ann_index.py [n] [dim] [queries]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 384
+    nq = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    rng = np.random.default_rng(0)
+    data = _clustered(n + nq, dim, 1000, rng)
+    corpus, queries = data[:n], data[n:]
+    configs = ([{'kind': 'flat', 'storage': storage, 'rescore': rescore}
+                for storage in ('float16', 'int8') for rescore in (False, True)]
+               + [{'kind': 'hnsw', 'ef_search': ef} for ef in (16, 32, 64, 128)]
+               + [{'kind': 'ivf_flat', 'nprobe': p} for p in (4, 16, 64)]
+               + [{'kind': 'ivf_pq', 'nprobe': p} for p in (4, 16, 64)]
+               + [{'kind': 'ivf_pq', 'nprobe': 16, 'rescore': True}])
+    print(f"n={n} dim={dim} queries={nq} k=10")
+    for row in recall_report(corpus, queries, 10, configs):
+        print(f"{row['index']:<34} recall@10={row['recall']:.3f}  top1={row['top1']:.3f}  "
+              f"{row['ms_per_query']:.3f} ms/query  {row['index_mb']:.1f} MB  build {row['build_s']:.1f}s")
@@ -0,0 +1,264 @@
+import os
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import List, Dict, Tuple, Optional
+
+import faiss
+import numpy as np
+
+# Queries arriving within EMBED_BATCH_MAX_WAIT_MS of each other are encoded in
+# one forward pass. EMBED_BATCH_MAX_WAIT_MS=0 only coalesces queries that queued
+# up while the previous batch was running; EMBED_BATCH_MAX_SIZE=1 disables
+# batching entirely.
+BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "2"))
+
+
+# Queued by `close` to stop the worker thread.
+_STOP = object()
+
+
+class _PendingQuery:
+    __slots__ = ('query', 'index', 'top_k', 'with_embedding', 'future', 'submitted')
+
+    def __init__(self, query: str, index, top_k: int, with_embedding: bool = False):
+        self.query = query
+        self.index = index
+        self.top_k = top_k
+        self.with_embedding = with_embedding
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+
+class QueryBatcher:
+    """Micro-batches concurrent query embeddings and FAISS searches.
+
+    Callers block in `search` or `embed_and_search` while a background thread
+    collects every query that arrives within `max_wait_ms` (up to
+    `max_batch_size`), encodes them in a single `encode` call, runs one
+    `index.search` per distinct index and hands each caller its own row of
+    scores and indices (and embedding, for `embed_and_search`).
+    """
+
+    def __init__(self, embedding_model, max_batch_size: int = BATCH_MAX_SIZE,
+                 max_wait_ms: float = BATCH_MAX_WAIT_MS):
+        self.embedding_model = embedding_model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._queries = 0
+        self._encode_seconds = 0.0
+        self._latencies = deque(maxlen=2048)
+        self._started = time.perf_counter()
+        self._closed = False
+        self._start_worker()
+
+    def _start_worker(self):
+        self._worker = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self._worker.start()
+
+    def _after_fork(self):
+        # Only the forking thread survives in the child: the worker thread is
+        # gone and the queue or stats lock may have been held mid-operation.
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        if not self._closed:
+            self._start_worker()
+
+    def close(self):
+        """Answer the queries already queued, then stop the worker thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._worker.join()
+
+    def _submit(self, pending: _PendingQuery):
+        if self._closed:
+            raise RuntimeError("QueryBatcher is closed")
+        self._queue.put(pending)
+        return pending.future.result()
+
+    def search(self, index, query: str, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return `(scores, indices)` shaped `(1, top_k)` like `index.search`."""
+        return self._submit(_PendingQuery(query, index, top_k))
+
+    def embed_and_search(self, index, query: str, top_k: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return `(embedding, scores, indices)`: `search` plus the query's `(1, dim)` embedding."""
+        return self._submit(_PendingQuery(query, index, top_k, with_embedding=True))
+
+    def embed(self, query: str) -> np.ndarray:
+        """Return the normalized `(1, dim)` query embedding without searching."""
+        return self._submit(_PendingQuery(query, None, 0))
+
+    def _collect(self) -> Tuple[List[_PendingQuery], bool]:
+        """The next batch, and whether `close` was called."""
+        item = self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect()
+            if not batch:
+                continue
+            try:
+                self._process(batch)
+            except Exception as e:
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+        # Queries that raced `close` fail rather than wait forever.
+        while True:
+            try:
+                pending = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            pending.future.set_exception(RuntimeError("QueryBatcher is closed"))
+
+    def _process(self, batch: List[_PendingQuery]):
+        start = time.perf_counter()
+        embeddings = self.embedding_model.encode([p.query for p in batch])
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+        faiss.normalize_L2(embeddings)
+        encoded = time.perf_counter()
+
+        # Requests racing a knowledge base update may target different indices.
+        groups: Dict[int, List[int]] = {}
+        for i, pending in enumerate(batch):
+            groups.setdefault(id(pending.index), []).append(i)
+        for rows in groups.values():
+            index = batch[rows[0]].index
+            if index is None:
+                for i in rows:
+                    batch[i].future.set_result(embeddings[i:i + 1])
+                continue
+            k = max(batch[i].top_k for i in rows)
+            scores, indices = index.search(embeddings[rows], k)
+            for row, i in enumerate(rows):
+                pending = batch[i]
+                hits = (scores[row:row + 1, :pending.top_k], indices[row:row + 1, :pending.top_k])
+                pending.future.set_result((embeddings[i:i + 1],) + hits if pending.with_embedding else hits)
+
+        done = time.perf_counter()
+        with self._lock:
+            self._batches += 1
+            self._queries += len(batch)
+            self._encode_seconds += encoded - start
+            self._latencies.extend(done - p.submitted for p in batch)
+
+    def stats(self) -> Dict:
+        """Throughput and latency figures since the batcher started."""
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000.0
+            elapsed = time.perf_counter() - self._started
+            return {
+                'queries': self._queries,
+                'batches': self._batches,
+                'avg_batch_size': self._queries / self._batches if self._batches else 0.0,
+                'avg_encode_ms': 1000.0 * self._encode_seconds / self._batches if self._batches else 0.0,
+                'p50_latency_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+                'p95_latency_ms': float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+                'queries_per_second': self._queries / elapsed if elapsed > 0 else 0.0,
+            }
+
+
+_batchers: Dict[int, QueryBatcher] = {}
+_batchers_lock = threading.Lock()
+
+
+def create_batcher(embedding_model) -> Optional[QueryBatcher]:
+    """Batcher for `embedding_model` from the environment settings, or None when disabled.
+
+    Bots sharing one model share one batcher, so their queries are encoded
+    together.
+    """
+    if BATCH_MAX_SIZE <= 1:
+        return None
+    with _batchers_lock:
+        if id(embedding_model) not in _batchers:
+            _batchers[id(embedding_model)] = QueryBatcher(embedding_model, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+        return _batchers[id(embedding_model)]
+
+
+def _reinit_after_fork():
+    global _batchers_lock
+    _batchers_lock = threading.Lock()
+    for batcher in _batchers.values():
+        batcher._after_fork()
+
+
+# Pre-forked API workers (serve.py) inherit the batchers created at startup.
+os.register_at_fork(after_in_child=_reinit_after_fork)
+
+
+def benchmark(kb, queries: List[str], concurrency: int = 16, rounds: int = 5,
+              max_batch_size: int = BATCH_MAX_SIZE, max_wait_ms: float = BATCH_MAX_WAIT_MS) -> Dict:
+    """Compare unbatched against micro-batched concurrent `kb.search` calls.
+
+    This is the retrieval path /api/chat runs. The semantic cache is off
+    for both runs so repeated rounds still reach the encoder.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    workload = queries * rounds
+    batcher, semantic_cache = kb.batcher, kb.semantic_cache
+
+    kb.batcher, kb.semantic_cache = None, None
+    try:
+        start = time.perf_counter()
+        for q in workload:
+            kb.search(q)
+        sequential = time.perf_counter() - start
+
+        kb.batcher = QueryBatcher(kb.query_model, max_batch_size, max_wait_ms)
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(kb.search, workload))
+            batched = time.perf_counter() - start
+            stats = kb.batcher.stats()
+        finally:
+            kb.batcher.close()
+    finally:
+        kb.batcher, kb.semantic_cache = batcher, semantic_cache
+
+    return {
+        'queries': len(workload),
+        'concurrency': concurrency,
+        'sequential_qps': len(workload) / sequential,
+        'batched_qps': len(workload) / batched,
+        'avg_batch_size': stats['avg_batch_size'],
+        'p50_latency_ms': stats['p50_latency_ms'],
+        'p95_latency_ms': stats['p95_latency_ms'],
+    }
+
+
+if __name__ == "__main__":
+    import En
+
+    En.initialize_bot()
+    questions = [item['question'] for item in En.kb.data]
+    for concurrency in (1, 4, 16, 32):
+        result = benchmark(En.kb, questions, concurrency=concurrency)
+        print(f"concurrency={concurrency:>3}  sequential={result['sequential_qps']:.1f} q/s  "
+              f"batched={result['batched_qps']:.1f} q/s  avg_batch={result['avg_batch_size']:.1f}  "
+              f"p50={result['p50_latency_ms']:.1f}ms  p95={result['p95_latency_ms']:.1f}ms")
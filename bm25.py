@@ -0,0 +1,109 @@
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from tokenization import Tokenizer
+
+
+class BM25Index:
+    """Okapi BM25 over a sparse document x term frequency matrix.
+
+    Instances are immutable like KnowledgeSnapshot: `with_added`,
+    `with_updated` and `with_deleted` return a new index that re-tokenizes
+    only the changed document. Term ids come from a vocabulary shared
+    append-only between an index and the ones derived from it, so older
+    instances ignore ids beyond their own columns.
+
+    Frequencies are stored raw and length normalization is applied at query
+    time, which keeps updates from touching every other document's weights.
+    """
+
+    __slots__ = ('tokenizer', 'k1', 'b', '_vocab', '_tf', '_doc_len')
+
+    def __init__(self, texts: Sequence[str], tokenizer: Tokenizer, k1: float = 1.5, b: float = 0.75):
+        self.tokenizer = tokenizer
+        self.k1 = k1
+        self.b = b
+        self._vocab: Dict[str, int] = {}
+        self._set(self._rows(texts))
+
+    def _rows(self, texts: Sequence[str]) -> sparse.csr_matrix:
+        """Term frequency rows for `texts`, adding unseen terms to the vocabulary."""
+        rows, cols, vals = [], [], []
+        for i, text in enumerate(texts):
+            counts: Dict[int, int] = {}
+            for token in self.tokenizer(text):
+                term = self._vocab.setdefault(token, len(self._vocab))
+                counts[term] = counts.get(term, 0) + 1
+            rows.extend([i] * len(counts))
+            cols.extend(counts)
+            vals.extend(counts.values())
+        return sparse.csr_matrix((np.asarray(vals, dtype='float32'), (rows, cols)),
+                                 shape=(len(texts), len(self._vocab)))
+
+    def _set(self, tf: sparse.spmatrix):
+        tf = sparse.csc_matrix(tf, dtype='float32')
+        if tf.shape[1] < len(self._vocab):
+            # New terms are empty columns; padding indptr shares the other arrays.
+            extra = len(self._vocab) - tf.shape[1]
+            indptr = np.concatenate([tf.indptr, np.full(extra, tf.indptr[-1], dtype=tf.indptr.dtype)])
+            tf = sparse.csc_matrix((tf.data, tf.indices, indptr), shape=(tf.shape[0], len(self._vocab)))
+        self._tf = tf
+        self._doc_len = np.asarray(tf.sum(axis=1), dtype='float32').ravel()
+
+    def _derive(self, rows: List[sparse.spmatrix]) -> 'BM25Index':
+        index = object.__new__(BM25Index)
+        index.tokenizer, index.k1, index.b, index._vocab = self.tokenizer, self.k1, self.b, self._vocab
+        index._set(sparse.vstack(rows, format='csc'))
+        return index
+
+    def __len__(self) -> int:
+        return self._tf.shape[0]
+
+    def with_added(self, text: str) -> 'BM25Index':
+        row = self._rows([text])
+        return self._derive([self._padded_rows(), row])
+
+    def with_updated(self, idx: int, text: str) -> 'BM25Index':
+        row = self._rows([text])
+        csr = self._padded_rows()
+        return self._derive([csr[:idx], row, csr[idx + 1:]])
+
+    def with_deleted(self, idx: int) -> 'BM25Index':
+        csr = self._padded_rows()
+        return self._derive([csr[:idx], csr[idx + 1:]])
+
+    def _padded_rows(self) -> sparse.csr_matrix:
+        csr = self._tf.tocsr()
+        if csr.shape[1] < len(self._vocab):
+            csr = sparse.csr_matrix((csr.data, csr.indices, csr.indptr), shape=(csr.shape[0], len(self._vocab)))
+        return csr
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for `query`."""
+        n_docs, n_terms = self._tf.shape
+        terms = {self._vocab.get(t) for t in self.tokenizer(query)}
+        terms = sorted(t for t in terms if t is not None and t < n_terms)
+        if not terms or not n_docs:
+            return np.zeros(n_docs, dtype='float32')
+        cols = self._tf[:, terms].tocoo()
+        df = np.diff(self._tf.indptr)[terms].astype('float32')
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+        avg_len = max(float(self._doc_len.mean()), 1.0)
+        norm = self.k1 * (1.0 - self.b + self.b * self._doc_len[cols.row] / avg_len)
+        weights = idf[cols.col] * cols.data * (self.k1 + 1.0) / (cols.data + norm)
+        return np.bincount(cols.row, weights=weights, minlength=n_docs).astype('float32')
+
+    def search(self, query: str, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """`(scores, indices)` shaped `(1, top_k)` like a FAISS search; misses are -1."""
+        scores = self.scores(query)
+        k = min(top_k, int(np.count_nonzero(scores)))
+        out_scores = np.zeros((1, top_k), dtype='float32')
+        out_ids = np.full((1, top_k), -1, dtype='int64')
+        if k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            out_scores[0, :k] = scores[top]
+            out_ids[0, :k] = top
+        return out_scores, out_ids
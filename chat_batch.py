@@ -0,0 +1,114 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import httpx
+
+# Bulk question answering through /api/chat/batch, e.g. replaying tickets:
+#   python chat_batch.py tickets.jsonl --url http://localhost:8000 --output answers.jsonl
+#   python chat_batch.py questions.txt --language jp          (in-process, no server)
+# Input lines are {"message", "language"} objects or plain messages; output is
+# one JSON object per input line, in input order, with the answer or an `error`.
+
+
+def read_items(lines, language: str = 'en') -> Iterator[Dict]:
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('{'):
+            item = json.loads(line)
+            yield {'message': item['message'], 'language': item.get('language', language)}
+        else:
+            yield {'message': line, 'language': language}
+
+
+def chunks(items: Sequence[Dict], size: int) -> Iterator[List[Dict]]:
+    for start in range(0, len(items), size):
+        yield list(items[start:start + size])
+
+
+class ServerClient:
+    """Posts batches to a running API, waiting out 503s as the server's Retry-After asks."""
+
+    def __init__(self, url: str, image_mode: Optional[str], retries: int = 5, timeout: float = 600.0):
+        self.client = httpx.Client(base_url=url, timeout=timeout)
+        self.image_mode = image_mode
+        self.retries = retries
+
+    def answer(self, items: List[Dict]) -> List[Dict]:
+        body = {'items': items, 'image_mode': self.image_mode}
+        for attempt in range(self.retries + 1):
+            response = self.client.post('/api/chat/batch', json=body)
+            if response.status_code != 503 or attempt == self.retries:
+                break
+            time.sleep(float(response.headers.get('Retry-After', '1')))
+        response.raise_for_status()
+        return response.json()['results']
+
+    def close(self):
+        self.client.close()
+
+
+class InProcessClient:
+    """Answers batches with the API's own batch path, without HTTP."""
+
+    def __init__(self, image_mode: Optional[str]):
+        import main
+
+        self.main = main
+        self.image_mode = image_mode or main.CHAT_IMAGE_MODE
+
+    def answer(self, items: List[Dict]) -> List[Dict]:
+        batch = [self.main.ChatBatchItem(**item) for item in items]
+        results = asyncio.run(self.main.answer_batch(batch, self.image_mode))
+        return [{key: result.get(key) for key in self.main.ChatBatchResult.model_fields} for result in results]
+
+    def close(self):
+        pass
+
+
+def main(argv: Optional[Sequence[str]] = None) -> Dict:
+    parser = argparse.ArgumentParser(description="Answer many chat messages in batches")
+    parser.add_argument('input', nargs='?', default='-', help="JSONL or text file, - for stdin")
+    parser.add_argument('--url', help="API base URL; answers in-process when omitted")
+    parser.add_argument('--language', default='en', choices=['en', 'jp'], help="for lines without one")
+    parser.add_argument('--batch-size', type=int, default=256, help="at most the server's CHAT_BATCH_MAX_ITEMS")
+    parser.add_argument('--image-mode', choices=['base64', 'url'], help="default: the server's CHAT_IMAGE_MODE")
+    parser.add_argument('--retries', type=int, default=5, help="retries of a batch rejected as busy (503)")
+    parser.add_argument('--output', help="JSONL results path (default stdout)")
+    args = parser.parse_args(argv)
+
+    if args.input == '-':
+        items = list(read_items(sys.stdin, args.language))
+    else:
+        with open(args.input, 'r', encoding='utf-8') as f:
+            items = list(read_items(f, args.language))
+
+    client = ServerClient(args.url, args.image_mode, args.retries) if args.url else InProcessClient(args.image_mode)
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    errors = 0
+    start = time.perf_counter()
+    try:
+        for batch in chunks(items, max(1, args.batch_size)):
+            for item, result in zip(batch, client.answer(batch)):
+                errors += bool(result.get('error'))
+                out.write(json.dumps(dict(item, **result), ensure_ascii=False) + '\n')
+            out.flush()
+    finally:
+        client.close()
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+    summary = {'items': len(items), 'errors': errors, 'seconds': elapsed,
+               'items_per_s': len(items) / elapsed if elapsed else 0.0}
+    print(f"{len(items)} messages in {elapsed:.1f}s ({summary['items_per_s']:.1f}/s), {errors} errors",
+          file=sys.stderr)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
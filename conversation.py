@@ -0,0 +1,64 @@
+import os
+import gc
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Sequence, Tuple
+
+# Each chatbot keeps its most recent exchanges (shared by every user of the
+# process) in a ring buffer of this size; older ones are dropped. 0 keeps none.
+CONVERSATION_HISTORY_SIZE = int(os.getenv("CONVERSATION_HISTORY_SIZE", "100"))
+
+
+def conversation_history(max_entries: int = CONVERSATION_HISTORY_SIZE) -> Deque[Dict]:
+    return deque(maxlen=max(0, max_entries))
+
+
+def memory_growth(chat: Callable[[str], Dict], queries: Sequence[str], requests: int,
+                  samples: int = 20, warmup: float = 0.1) -> Tuple[List[Tuple[int, float]], float]:
+    """Drive `requests` chat calls and sample resident memory along the way.
+
+    Queries are cycled with a request counter appended, so the response,
+    semantic and image caches fill up and evict as they would under real
+    traffic. Returns the `(requests_done, rss_mb)` samples and the growth
+    between the end of the warmup fraction (caches full, lazy state built)
+    and the highest later sample.
+    """
+    from models import _rss_mb
+
+    every = max(1, requests // samples)
+    warm_at = max(every, int(requests * warmup) // every * every)
+    history: List[Tuple[int, float]] = []
+    baseline = None
+    for i in range(1, requests + 1):
+        chat(f"{queries[i % len(queries)]} {i}")
+        if i % every == 0 or i == requests:
+            gc.collect()
+            history.append((i, _rss_mb()))
+            if i == warm_at:
+                baseline = history[-1][1]
+    if baseline is None:
+        baseline = history[0][1]
+    later = [rss for i, rss in history if i >= warm_at]
+    return history, max(later) - baseline
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Memory soak: python conversation.py [requests] [en|jp] [tolerance_mb]
+    # Exits non-zero when RSS keeps growing after warmup.
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    language = sys.argv[2] if len(sys.argv) > 2 else 'en'
+    tolerance_mb = float(sys.argv[3]) if len(sys.argv) > 3 else 16.0
+    bot = __import__('Jp' if language == 'jp' else 'En')
+
+    bot.initialize_bot()
+    queries = [item['question'] for item in bot.kb.data]
+    start = time.perf_counter()
+    history, growth = memory_growth(bot.enhanced_chat_response, queries, requests)
+    elapsed = time.perf_counter() - start
+    for done, rss in history:
+        print(f"{done:>9} requests  RSS {rss:.1f} MB")
+    print(f"{requests} {language} requests in {elapsed:.0f}s ({requests / elapsed:.0f}/s), "
+          f"history holds {len(bot.chatbot.conversation_history)}, growth after warmup {growth:+.1f} MB")
+    sys.exit(0 if growth <= tolerance_mb else 1)
@@ -0,0 +1,244 @@
+import os
+import re
+import glob
+import json
+import fcntl
+import hashlib
+import threading
+import contextlib
+from typing import List, Dict, Iterator, Tuple, Optional, Callable
+
+import faiss
+import numpy as np
+
+from ann_index import build_search_index, index_spec, read_index
+from observability import fields, get_logger
+
+log = get_logger('embedding_cache')
+
+# Entry embeddings and serialized FAISS indices survive restarts here, so a
+# cold start or reload only encodes entries whose text actually changed.
+CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR",
+                      os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+
+
+def _slug(name: str) -> str:
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', name)
+
+
+def _atomic_write(path: str, write: Callable[[str], None]):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _write_text(path: str, text: str):
+    def write(tmp):
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    _atomic_write(path, write)
+
+
+class EmbeddingStore:
+    """Append-only matrix of normalized embeddings for one model, keyed by entry.
+
+    Rows live in a raw float32 file (`<model>.f32`, opened with `np.memmap`)
+    next to a `<model>.keys` file holding one key per row. Every chatbot and
+    every process using the model shares these files: there is one store per
+    file in a process (see `embedding_store`), and appends hold an exclusive
+    `flock` on `<model>.lock` while they pick up rows other writers added,
+    then write vectors and keys. A row's number is its position in the file.
+    """
+
+    def __init__(self, base: str, model_name: str):
+        self.model_name = model_name
+        self.vectors_path = f"{base}.f32"
+        self.keys_path = f"{base}.keys"
+        self.meta_path = f"{base}.json"
+        self.lock_path = f"{base}.lock"
+        self.dim: Optional[int] = None
+        self._keys: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._keys_offset = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _reset(self):
+        self.dim = None
+        self._keys, self._rows, self._keys_offset, self._matrix = [], {}, 0, None
+
+    def _sync(self):
+        """Catch up with rows appended by other writers. Call with the file lock held."""
+        try:
+            if self.dim is None:
+                if not os.path.exists(self.meta_path):
+                    return
+                with open(self.meta_path, 'r', encoding='utf-8') as f:
+                    self.dim = int(json.load(f)['dim'])
+            try:
+                with open(self.keys_path, 'rb') as f:
+                    f.seek(self._keys_offset)
+                    data = f.read()
+            except FileNotFoundError:
+                data = b''
+            # A writer that died mid-line leaves a partial key; nobody else can be writing now.
+            complete = data[:data.rfind(b'\n') + 1]
+            if len(complete) < len(data):
+                os.truncate(self.keys_path, self._keys_offset + len(complete))
+            self._keys_offset += len(complete)
+            for key in complete.decode('utf-8').split():
+                self._rows[key] = len(self._keys)
+                self._keys.append(key)
+
+            # An interrupted append can leave the two files out of step; keep
+            # only rows present in both and trim the rest.
+            row_bytes = 4 * self.dim
+            size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+            if size // row_bytes < len(self._keys):
+                keys = self._keys[:size // row_bytes]
+                _write_text(self.keys_path, ''.join(k + '\n' for k in keys))
+                self._keys, self._rows = keys, {key: i for i, key in enumerate(keys)}
+                self._keys_offset = os.path.getsize(self.keys_path)
+            if size != len(self._keys) * row_bytes:
+                os.truncate(self.vectors_path, len(self._keys) * row_bytes)
+            self._matrix = (np.memmap(self.vectors_path, dtype='float32', mode='r', shape=(len(self._keys), self.dim))
+                            if self._keys else None)
+        except Exception as e:
+            log.warning("ignoring unreadable embedding cache", extra=fields(path=self.vectors_path, error=str(e)))
+            self._reset()
+            for path in (self.vectors_path, self.keys_path, self.meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _append(self, keys: List[str], vectors: np.ndarray):
+        with self._file_lock():
+            self._sync()
+            # Another writer may have stored some of these meanwhile.
+            keep = [i for i, key in enumerate(keys) if key not in self._rows]
+            if not keep:
+                return
+            keys, vectors = [keys[i] for i in keep], vectors[keep]
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                _write_text(self.meta_path, json.dumps({'model': self.model_name, 'dim': self.dim}))
+            # Vectors first: a crash before the keys land leaves unreferenced rows
+            # that the next writer trims, never keys pointing at missing rows.
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.ascontiguousarray(vectors, dtype='float32').tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.keys_path, 'ab') as f:
+                f.write(''.join(k + '\n' for k in keys).encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+            # Rows numbered from the file, which _sync left exactly len(self._keys) rows long.
+            self._sync()
+
+    def embed(self, keys: List[str], texts: List[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        with self._lock:
+            # Other processes may have appended since the last call; their rows
+            # are reused rather than encoded (and appended) again.
+            with self._file_lock():
+                self._sync()
+            missing = list(dict.fromkeys(key for key in keys if key not in self._rows))
+            if missing:
+                text_for = dict(zip(keys, texts))
+                fresh = np.ascontiguousarray(encode([text_for[key] for key in missing]), dtype='float32')
+                faiss.normalize_L2(fresh)
+                self._append(missing, fresh)
+            if not keys:
+                return np.zeros((0, self.dim or 0), dtype='float32')
+            rows = np.fromiter((self._rows[key] for key in keys), dtype=np.int64, count=len(keys))
+            if np.all(np.diff(rows) == 1):
+                return self._matrix[rows[0]:rows[-1] + 1]
+            return np.asarray(self._matrix[rows])
+
+
+_stores: Dict[str, EmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def embedding_store(model_name: str, cache_dir: str = CACHE_DIR) -> EmbeddingStore:
+    """The process-wide store for `model_name`'s embeddings in `cache_dir`."""
+    base = os.path.join(os.path.abspath(cache_dir), _slug(model_name))
+    with _stores_lock:
+        store = _stores.get(base)
+        if store is None:
+            os.makedirs(cache_dir, exist_ok=True)
+            store = _stores[base] = EmbeddingStore(base, model_name)
+        return store
+
+
+class EmbeddingCache:
+    """Entry embeddings and built FAISS indices for one namespace (a chatbot).
+
+    Embeddings are keyed by sha256(model name + entry text), so the same text
+    encoded by the same model is never encoded twice, and are kept in the
+    model's shared `EmbeddingStore`. A built index is stored per `namespace`
+    and keyed by the ordered list of entry keys.
+    """
+
+    def __init__(self, model_name: str, namespace: str, cache_dir: str = CACHE_DIR):
+        self.model_name = model_name
+        self.namespace = namespace
+        self.cache_dir = cache_dir
+        self.store = embedding_store(model_name, cache_dir)
+
+    def entry_key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def embed(self, texts: List[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Return L2-normalized float32 embeddings, encoding only uncached texts.
+
+        When the requested rows are stored contiguously (the usual case for a
+        dataset that has only been appended to) the result is a read-only view
+        of the memory-mapped matrix rather than a copy.
+        """
+        return self.store.embed([self.entry_key(t) for t in texts], texts, encode)
+
+    def _index_path(self, keys: List[str], spec: str = 'Flat') -> str:
+        # The index type is part of the name, so switching FAISS_INDEX never reads a stale layout.
+        digest = hashlib.sha256('\n'.join([spec] + keys).encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.cache_dir, f"{_slug(self.namespace)}-{digest}.faiss")
+
+    def load_index(self, keys: List[str], spec: str = 'Flat') -> Optional[faiss.Index]:
+        path = self._index_path(keys, spec)
+        if not os.path.exists(path):
+            return None
+        try:
+            return read_index(path)
+        except Exception as e:
+            log.warning("ignoring unreadable index cache", extra=fields(path=path, error=str(e)))
+            return None
+
+    def save_index(self, keys: List[str], index: faiss.Index, spec: str = 'Flat'):
+        path = self._index_path(keys, spec)
+        _atomic_write(path, lambda tmp: faiss.write_index(index, tmp))
+        # Only the index matching the current dataset is worth keeping.
+        for stale in glob.glob(os.path.join(self.cache_dir, f"{_slug(self.namespace)}-*.faiss")):
+            if stale != path:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+    def load_or_build(self, texts: List[str], encode: Callable[[List[str]], np.ndarray]) -> Tuple[np.ndarray, faiss.Index]:
+        """Return `(embeddings, index)` for `texts`, reusing whatever is on disk."""
+        keys = [self.entry_key(t) for t in texts]
+        embeddings = self.embed(texts, encode)
+        spec = index_spec(len(keys), embeddings.shape[1])
+        index = self.load_index(keys, spec)
+        if index is None:
+            index = build_search_index(embeddings)
+            self.save_index(keys, index, spec)
+        return embeddings, index
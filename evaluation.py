@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import argparse
+import contextlib
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ann_index import build_search_index
+from knowledge_store import DATA_DIR
+from models import embedding_model_for
+from semantic_cache import SemanticCache
+
+# Offline retrieval evaluation: every labeled query is searched under each
+# retriever configuration and scored against the entries it should return.
+#   python evaluation.py [--configs flat hnsw int8_encoder ...] [--k 3] [--output report.json]
+# Each line of the labels file is {"query", "language", "expected"}, where
+# "expected" lists the questions of acceptable entries, or is null for a
+# query the bot should decline as out of context.
+EVAL_QUERIES = os.path.join(DATA_DIR, 'eval_queries.jsonl')
+
+# Retriever variants. Index settings rebuild the snapshot's index from its
+# embeddings (ANN types are forced even on a small knowledge base), "encoder"
+# swaps the query encoder and "semantic_cache" answers later queries from
+# earlier ones when they are close enough.
+CONFIGS = {
+    'flat': {},
+    'flat_float16': {'storage': 'float16'},
+    'flat_int8': {'storage': 'int8'},
+    'hnsw': {'index': 'hnsw'},
+    'ivf_flat': {'index': 'ivf_flat'},
+    'int8_encoder': {'encoder': 'int8'},
+    'onnx_encoder': {'encoder': 'onnx'},
+    'semantic_cache': {'semantic_cache': True},
+}
+
+
+def load_labels(path: str = EVAL_QUERIES) -> List[Dict]:
+    labels = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                if isinstance(item.get('expected'), str):
+                    item['expected'] = [item['expected']]
+                labels.append(item)
+    return labels
+
+
+@contextlib.contextmanager
+def configured(kb, config: Dict) -> Iterator[None]:
+    """Apply a retriever configuration to `kb` for the duration of the block.
+
+    Searches run one at a time without the micro-batcher, so latencies are
+    those of a single query rather than of a batching window.
+    """
+    snap = kb._snapshot
+    saved = (kb.query_model, kb.batcher, kb.semantic_cache)
+    try:
+        if config.get('index', 'flat') != 'flat' or config.get('storage', 'float32') != 'float32':
+            index = build_search_index(snap.embeddings, config.get('index', 'flat'),
+                                       config.get('storage', 'float32'), min_size=0)
+            kb.adopt_index(index, snap.embeddings)
+        if config.get('encoder', 'fp32') != 'fp32':
+            kb.query_model = embedding_model_for(kb.embedding_model.name, config['encoder'])
+        kb.batcher = None
+        kb.semantic_cache = SemanticCache() if config.get('semantic_cache') else None
+        # Load the encoder outside the timed searches.
+        kb.embed_query("warmup")
+        yield
+    finally:
+        kb.query_model, kb.batcher, kb.semantic_cache = saved
+        kb.adopt_index(snap.index, snap.embeddings)
+
+
+def evaluate(kb, labels: Sequence[Dict], k: int = 3, min_score: float = 0.30) -> Tuple[Dict, List[Dict]]:
+    """`(summary, per_query_rows)` for `labels` searched in `kb` as configured now."""
+    rows = []
+    for item in labels:
+        start = time.perf_counter()
+        results = kb.search(item['query'], top_k=k, min_score=min_score)
+        ms = (time.perf_counter() - start) * 1000.0
+        returned = [r['question'] for r in results]
+        expected = item.get('expected')
+        rank = next((i + 1 for i, question in enumerate(returned) if expected and question in expected), None)
+        rows.append({'query': item['query'], 'expected': expected, 'returned': returned,
+                     'match_types': [r['match_type'] for r in results], 'rank': rank, 'ms': ms})
+    return summarize(rows, k), rows
+
+
+def summarize(rows: Sequence[Dict], k: int) -> Dict:
+    """recall@1, recall@k and MRR over answerable queries; precision and recall of declining the rest.
+
+    A query is declined when search returns nothing, which the chatbots turn
+    into their out-of-context reply.
+    """
+    answerable = [r for r in rows if r['expected']]
+    declined = [r for r in rows if not r['returned']]
+    out_of_context = len(rows) - len(answerable)
+    correct_declines = sum(1 for r in declined if not r['expected'])
+    latencies = [r['ms'] for r in rows]
+    mean = lambda values: float(np.mean(values)) if len(values) else 0.0
+    return {
+        'queries': len(rows),
+        'k': k,
+        'recall_at_1': mean([r['rank'] == 1 for r in answerable]),
+        'recall_at_k': mean([r['rank'] is not None for r in answerable]),
+        'mrr': mean([1.0 / r['rank'] if r['rank'] else 0.0 for r in answerable]),
+        'ooc_precision': correct_declines / len(declined) if declined else None,
+        'ooc_recall': correct_declines / out_of_context if out_of_context else None,
+        'mean_ms': mean(latencies),
+        'p50_ms': float(np.percentile(latencies, 50)) if latencies else 0.0,
+        'p95_ms': float(np.percentile(latencies, 95)) if latencies else 0.0,
+    }
+
+
+def _format(language: str, name: str, summary: Dict) -> str:
+    ratio = lambda value: 'n/a' if value is None else f"{value:.1%}"
+    return (f"{language} {name:<15} recall@1={summary['recall_at_1']:.1%}  "
+            f"recall@{summary['k']}={summary['recall_at_k']:.1%}  MRR={summary['mrr']:.3f}  "
+            f"ooc precision={ratio(summary['ooc_precision'])} recall={ratio(summary['ooc_recall'])}  "
+            f"p50={summary['p50_ms']:.1f}ms p95={summary['p95_ms']:.1f}ms")
+
+
+def main(argv: Optional[Sequence[str]] = None) -> Dict:
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality and latency")
+    parser.add_argument('--labels', default=EVAL_QUERIES)
+    parser.add_argument('--configs', nargs='+', default=list(CONFIGS), choices=list(CONFIGS))
+    parser.add_argument('--language', nargs='+', default=['en', 'jp'], choices=['en', 'jp'])
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--min-score', type=float, help="default: the chatbot's confidence threshold")
+    parser.add_argument('--output', help="write summaries and per-query rows as JSON")
+    args = parser.parse_args(argv)
+
+    labels = load_labels(args.labels)
+    report = {'labels': args.labels, 'k': args.k, 'results': []}
+    for language in args.language:
+        bot = __import__('Jp' if language == 'jp' else 'En')
+        bot.initialize_bot()
+        min_score = args.min_score if args.min_score is not None else bot.chatbot.confidence_threshold
+        queries = [item for item in labels if item.get('language', 'en') == language]
+        for name in args.configs:
+            entry = {'language': language, 'config': name, 'settings': CONFIGS[name], 'min_score': min_score}
+            try:
+                with configured(bot.kb, CONFIGS[name]):
+                    summary, rows = evaluate(bot.kb, queries, args.k, min_score)
+            except Exception as e:
+                # Optional encoders (onnx) may not be installed.
+                entry['error'] = str(e)
+                print(f"{language} {name:<15} unavailable: {e}")
+            else:
+                entry.update(summary=summary, queries=rows)
+                print(_format(language, name, summary))
+            report['results'].append(entry)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Saved {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import io
+import os
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Iterable, Optional
+
+from PIL import Image
+
+from observability import fields, get_logger
+
+log = get_logger('image_cache')
+
+# Encoded image payloads kept in memory. Keys include the file's mtime and
+# size, so replacing an image on disk is picked up on the next request.
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", "256"))
+# Directory served by /api/images; knowledge base image_path values under it
+# can be returned to clients as cacheable URLs instead of inline base64.
+IMAGE_DIR = os.getenv("IMAGE_DIR", "images")
+IMAGE_URL_PREFIX = "/api/images"
+
+
+class ImageCache:
+    """Thread-safe LRU of base64 image payloads."""
+
+    def __init__(self, max_entries: int = IMAGE_CACHE_SIZE):
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key: Hashable, build: Callable[[], str]) -> str:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        # Built outside the lock; two threads missing together both encode once.
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+image_cache = ImageCache()
+
+
+def _encode_file(path: str, fmt: Optional[str]) -> str:
+    if fmt is None:
+        with open(path, 'rb') as f:
+            return base64.b64encode(f.read()).decode('utf-8')
+    with Image.open(path) as img:
+        if fmt.upper() == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        buffer = io.BytesIO()
+        img.save(buffer, format=fmt)
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
+def file_base64(path: str, fmt: Optional[str] = None) -> Optional[str]:
+    """Base64 of the image at `path`, re-encoded to `fmt` if given; None if missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size, fmt)
+    return image_cache.get_or_create(key, lambda: _encode_file(path, fmt))
+
+
+def file_etag(path: str) -> Optional[str]:
+    """sha256 of the file's bytes, cached per path + mtime; None if missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    def build():
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    return image_cache.get_or_create((os.path.abspath(path), st.st_mtime_ns, st.st_size, 'etag'), build)
+
+
+def servable_image_path(name: str) -> Optional[str]:
+    """Path of `name` inside IMAGE_DIR, or None if it is not a plain existing file there."""
+    if not name or name != os.path.basename(name) or name.startswith('.'):
+        return None
+    path = os.path.join(IMAGE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def url_version(digest: str) -> str:
+    """The `?v=` token versioned image URLs carry for a file with ETag digest `digest`."""
+    return digest[:16]
+
+
+def image_url(path: str) -> Optional[str]:
+    """Versioned /api/images URL for `path`, or None if the endpoint cannot serve it."""
+    served = servable_image_path(os.path.basename(path or ''))
+    if served is None or not os.path.exists(path) or not os.path.samefile(served, path):
+        return None
+    return f"{IMAGE_URL_PREFIX}/{os.path.basename(path)}?v={url_version(file_etag(served))}"
+
+
+def placeholder_base64(text: str, render: Callable[[str], Image.Image]) -> str:
+    """Base64 PNG of `render(text)`, rendered once per distinct text."""
+    def build():
+        buffer = io.BytesIO()
+        render(text).save(buffer, format='PNG')
+        return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+    return image_cache.get_or_create(('placeholder', text), build)
+
+
+def warm(paths: Iterable[Optional[str]], fmt: Optional[str] = None):
+    """Encode every existing image up front so first requests hit the cache."""
+    for path in set(p for p in paths if p):
+        try:
+            file_base64(path, fmt)
+        except Exception as e:
+            log.warning("image caching failed", extra=fields(path=path, error=str(e)))
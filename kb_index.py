@@ -0,0 +1,272 @@
+import copy
+import itertools
+import threading
+from collections import deque
+from typing import List, Dict, Tuple, Optional, Callable, Iterable, Set
+
+import faiss
+import numpy as np
+
+from ann_index import (MutableIndex, RescoringIndex, build_search_index, copy_index, is_lossy,
+                       search_parameters)
+from bm25 import BM25Index
+from tokenization import Tokenizer, TokenIndex, word_tokenize
+
+
+def entry_text(item: Dict) -> str:
+    """Text that gets embedded for a knowledge base entry."""
+    return f"{item['question']} {item['answer']} {' '.join(item.get('related_topics', []))}"
+
+
+def lexical_text(item: Dict) -> str:
+    """Text indexed by BM25 for a knowledge base entry."""
+    return f"{item['question']} {item['answer']}"
+
+
+def build_lookup_indices(data: List[Dict]) -> Tuple[Dict[str, List[int]], Dict[str, List[int]]]:
+    """Category -> entry ids and lowercased keyword -> entry ids."""
+    category_index: Dict[str, List[int]] = {}
+    keyword_index: Dict[str, List[int]] = {}
+    for i, item in enumerate(data):
+        category_index.setdefault(item.get('category', 'general'), []).append(i)
+        for kw in item.get('keywords', []):
+            keyword_index.setdefault(kw.lower(), []).append(i)
+    return category_index, keyword_index
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton over the keyword vocabulary.
+
+    `find` reports every keyword occurring as a substring of the text in a
+    single pass over it, independent of how many keywords there are.
+    Matches come back in vocabulary order so callers that break ties by
+    insertion order behave as they did with a linear scan.
+    """
+
+    __slots__ = ('_keywords', '_goto', '_fail', '_out')
+
+    def __init__(self, keywords: Iterable[str]):
+        self._keywords = list(keywords)
+        goto: List[Dict[str, int]] = [{}]
+        out: List[List[int]] = [[]]
+        for rank, kw in enumerate(self._keywords):
+            if not kw:
+                continue
+            state = 0
+            for ch in kw:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            out[state].append(rank)
+
+        # Breadth-first failure links; outputs of the fallback state are merged in.
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    def find(self, text: str) -> List[str]:
+        goto, fail, out = self._goto, self._fail, self._out
+        found: Set[int] = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return [self._keywords[rank] for rank in sorted(found)]
+
+
+_versions = itertools.count(1)
+
+
+class KnowledgeSnapshot:
+    """Immutable searchable state of a knowledge base.
+
+    Writers build a new snapshot and swap it in with a single attribute
+    assignment, so a search that captured the previous snapshot keeps seeing a
+    consistent data list, index and lookup tables until it finishes.
+    """
+
+    __slots__ = ('data', 'embeddings', 'index', 'category_index', 'keyword_index',
+                 'keyword_automaton', 'tokenizer', 'keyword_tokens', 'bm25', 'searcher', 'version')
+
+    def __init__(self, data: List[Dict], embeddings: np.ndarray, index: faiss.Index,
+                 category_index: Optional[Dict[str, List[int]]] = None,
+                 keyword_index: Optional[Dict[str, List[int]]] = None,
+                 tokenizer: Optional[Tokenizer] = None,
+                 bm25: Optional[BM25Index] = None):
+        if category_index is None or keyword_index is None:
+            category_index, keyword_index = build_lookup_indices(data)
+        self.data = data
+        self.embeddings = embeddings
+        self.index = index
+        self.searcher = searcher_for(index, embeddings)
+        self.category_index = category_index
+        self.keyword_index = keyword_index
+        self.keyword_automaton = KeywordAutomaton(keyword_index)
+        # With a tokenizer, keywords are also indexed by token for queries
+        # that have no word boundaries (Japanese).
+        self.tokenizer = tokenizer
+        self.keyword_tokens = TokenIndex(keyword_index, tokenizer) if tokenizer is not None else None
+        # Lexical retriever over question + answer; derived snapshots pass
+        # in an incrementally updated copy instead of re-tokenizing everything.
+        if bm25 is None:
+            bm25 = BM25Index([lexical_text(item) for item in data], tokenizer or word_tokenize)
+        self.bm25 = bm25
+        # Unique per snapshot; caches keyed on it go stale with every swap.
+        self.version = next(_versions)
+
+    def with_index(self, index) -> 'KnowledgeSnapshot':
+        snap = copy.copy(self)
+        snap.index = index
+        snap.searcher = searcher_for(index, self.embeddings)
+        snap.version = next(_versions)
+        return snap
+
+    def with_added(self, item: Dict, vector: np.ndarray,
+                   build: Optional[Callable[[np.ndarray], object]] = None) -> 'KnowledgeSnapshot':
+        """Append one entry; the existing vectors are copied, never re-encoded.
+
+        `build` turns the new embedding matrix into a searchable index; by
+        default the current index is cloned and extended without retraining.
+        """
+        idx = len(self.data)
+        embeddings = np.vstack([self.embeddings, vector.reshape(1, -1)])
+        if build is not None:
+            index = build(embeddings)
+        elif isinstance(self.index, MutableIndex):
+            index = self.index.with_added(vector)
+        else:
+            index = copy_index(self.index)
+            index.add(np.ascontiguousarray(vector.reshape(1, -1), dtype='float32'))
+        category_index = dict(self.category_index)
+        cat = item.get('category', 'general')
+        category_index[cat] = category_index.get(cat, []) + [idx]
+        keyword_index = dict(self.keyword_index)
+        for kw in item.get('keywords', []):
+            kw = kw.lower()
+            keyword_index[kw] = keyword_index.get(kw, []) + [idx]
+        return KnowledgeSnapshot(self.data + [item], embeddings, index, category_index, keyword_index,
+                                 self.tokenizer, self.bm25.with_added(lexical_text(item)))
+
+    def with_updated(self, idx: int, item: Dict, vector: np.ndarray,
+                     build: Optional[Callable[[np.ndarray], object]] = None) -> 'KnowledgeSnapshot':
+        data = list(self.data)
+        data[idx] = item
+        embeddings = np.array(self.embeddings, dtype='float32')
+        embeddings[idx] = vector
+        index = build(embeddings) if build is not None else _edited(
+            self.index, embeddings, lambda index: index.with_updated(idx, vector))
+        return KnowledgeSnapshot(data, embeddings, index, tokenizer=self.tokenizer,
+                                 bm25=self.bm25.with_updated(idx, lexical_text(item)))
+
+    def with_deleted(self, idx: int,
+                     build: Optional[Callable[[np.ndarray], object]] = None) -> 'KnowledgeSnapshot':
+        data = self.data[:idx] + self.data[idx + 1:]
+        embeddings = np.delete(self.embeddings, idx, axis=0)
+        index = build(embeddings) if build is not None else _edited(
+            self.index, embeddings, lambda index: index.with_deleted(idx))
+        return KnowledgeSnapshot(data, embeddings, index, tokenizer=self.tokenizer,
+                                 bm25=self.bm25.with_deleted(idx))
+
+
+def _edited(index, embeddings: np.ndarray, edit: Callable[[MutableIndex], MutableIndex]):
+    """`index` with one entry changed by `edit`, without retraining it.
+
+    HNSW and IVF indices are edited in place until too much of them has
+    changed (see FAISS_REBUILD_FRACTION); flat indices need no training and
+    are simply rebuilt from `embeddings`.
+    """
+    if not MutableIndex.supports(index):
+        return build_search_index(embeddings)
+    edited = edit(index if isinstance(index, MutableIndex) else MutableIndex(index))
+    return build_search_index(embeddings) if edited.needs_rebuild() else edited
+
+
+class PartitionView:
+    """One language's slice of a LanguagePartitionedIndex.
+
+    Searches like a FAISS index over that language's entries only, returning
+    entry ids local to the language.
+    """
+
+    def __init__(self, index: faiss.Index, offset: int, ntotal: int):
+        self.index = index
+        self.offset = offset
+        self.ntotal = ntotal
+
+    def search(self, x: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        selector = faiss.IDSelectorRange(self.offset, self.offset + self.ntotal)
+        scores, ids = self.index.search(x, k, params=search_parameters(self.index, selector))
+        return scores, np.where(ids >= 0, ids - self.offset, -1)
+
+
+class LanguagePartitionedIndex:
+    """A single FAISS index shared by every language's knowledge base.
+
+    Each language owns a contiguous id range. Publishing a language's vectors
+    produces a new combined index and hands every other registered knowledge
+    base a view onto it, so only one index is resident per process. When the
+    last range only grew (entries appended), the combined index is copied and
+    extended; any other change rebuilds it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._partitions: Dict[str, np.ndarray] = {}
+        self._owners: Dict[str, object] = {}
+        self._combined: Optional[faiss.Index] = None
+
+    def publish(self, language: str, embeddings: np.ndarray, owner) -> PartitionView:
+        with self._lock:
+            previous = self._partitions.get(language)
+            self._partitions[language] = embeddings
+            self._owners[language] = owner
+            languages = sorted(self._partitions)
+            if (previous is not None and language == languages[-1] and len(embeddings) > len(previous)
+                    and np.array_equal(embeddings[:len(previous)], previous)):
+                combined = copy_index(self._combined)
+                combined.add(np.ascontiguousarray(embeddings[len(previous):], dtype='float32'))
+            else:
+                combined = build_search_index(np.vstack([self._partitions[lang] for lang in languages]))
+            self._combined = combined
+            views, offset = {}, 0
+            for lang in languages:
+                views[lang] = PartitionView(combined, offset, len(self._partitions[lang]))
+                offset += len(self._partitions[lang])
+            for lang in languages:
+                if lang != language:
+                    self._owners[lang].adopt_index(views[lang], self._partitions[lang])
+            return views[language]
+
+
+def searcher_for(index, embeddings: np.ndarray):
+    """What searches should call: `index` itself, or a float32 re-ranker over it when it is lossy."""
+    base = index.index if isinstance(index, (PartitionView, MutableIndex)) else index
+    return RescoringIndex(index, embeddings) if is_lossy(base) else index
+
+
+_shared_index: Optional[LanguagePartitionedIndex] = None
+
+
+def get_shared_index() -> LanguagePartitionedIndex:
+    global _shared_index
+    if _shared_index is None:
+        _shared_index = LanguagePartitionedIndex()
+    return _shared_index
@@ -0,0 +1,125 @@
+import os
+import json
+import fcntl
+import threading
+import contextlib
+from typing import List, Dict, Iterator, Optional, Tuple
+
+from observability import fields, get_logger
+
+log = get_logger('knowledge_store')
+
+DATA_DIR = os.getenv("KNOWLEDGE_DATA_DIR",
+                     os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+
+
+def _fsync_write(f, text: str):
+    f.write(text)
+    f.flush()
+    os.fsync(f.fileno())
+
+
+class KnowledgeStore:
+    """Knowledge base entries stored as JSON Lines, one entry per line.
+
+    The file is parsed once and served from memory until it changes on disk.
+    Appends write a single fsynced line; updates and deletes rewrite the file
+    into a temp copy and atomically replace it, so a crash leaves either the
+    old or the new dataset on disk, never a mix.
+
+    Several processes (pre-forked or uvicorn workers) may share the file.
+    Writes hold an exclusive `flock` on `<path>.lock` and start from what is
+    on disk, and `changed()` tells a process that another one has written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Optional[List[Dict]] = None
+        self._seen: Optional[Tuple[int, int, int]] = None
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self._lock_depth = 0
+
+    def _signature(self) -> Optional[Tuple[int, int, int]]:
+        # Appends change the size, rewrites (os.replace) the inode.
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def changed(self) -> bool:
+        """Whether the file differs from what this process last read or wrote (one stat call)."""
+        return self._entries is not None and self._signature() != self._seen
+
+    @contextlib.contextmanager
+    def locked(self) -> Iterator[None]:
+        """Exclusive access to the file across threads and processes; reentrant within a thread."""
+        with self._lock:
+            if self._lock_depth == 0:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                self._lock_file = open(f"{self.path}.lock", 'a')
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def _load(self) -> List[Dict]:
+        if self._entries is None or self._signature() != self._seen:
+            seen = self._signature()
+            entries = []
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line_no, line in enumerate(f, 1):
+                        if not line.strip():
+                            continue
+                        try:
+                            entries.append(json.loads(line))
+                        except json.JSONDecodeError as e:
+                            # A torn final line from an interrupted append is dropped.
+                            log.warning("skipping unreadable entry", extra=fields(path=self.path, line=line_no, error=str(e)))
+            self._entries = entries
+            self._seen = seen
+        return self._entries
+
+    def entries(self) -> List[Dict]:
+        """All entries in file order, re-read if the file changed. Callers must treat the list as read-only."""
+        with self.locked():
+            return self._load()
+
+    def __len__(self) -> int:
+        return len(self.entries())
+
+    def append(self, item: Dict):
+        with self.locked():
+            entries = self._load()
+            with open(self.path, 'a', encoding='utf-8') as f:
+                _fsync_write(f, json.dumps(item, ensure_ascii=False) + '\n')
+            self._entries = entries + [item]
+            self._seen = self._signature()
+
+    def replace(self, idx: int, item: Dict):
+        with self.locked():
+            entries = list(self._load())
+            entries[idx] = item
+            self._rewrite(entries)
+
+    def delete(self, idx: int):
+        with self.locked():
+            entries = list(self._load())
+            del entries[idx]
+            self._rewrite(entries)
+
+    def _rewrite(self, entries: List[Dict]):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            _fsync_write(f, ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in entries))
+        os.replace(tmp, self.path)
+        self._entries = entries
+        self._seen = self._signature()
@@ -0,0 +1,321 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import httpx
+import numpy as np
+
+from knowledge_store import KnowledgeStore, DATA_DIR
+from serve import memory_mb, worker_pids
+
+# Load test for /api/chat, in-process (httpx over ASGI) or against a local
+# uvicorn / serve.py server, e.g.
+#   python loadtest.py --target inprocess uvicorn --concurrency 1 8 32 --mix mixed jp
+#   python loadtest.py --compare loadtest-<old sha>.json
+# Workloads are generated from a seed, so two commits run the same requests.
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+OUT_OF_CONTEXT = {
+    'en': [
+        "What's the weather in Paris today?",
+        "How do I bake sourdough bread?",
+        "Who won the 2018 World Cup?",
+        "Explain quantum entanglement simply",
+        "Recommend a good science fiction novel",
+    ],
+    'jp': [
+        "今日の天気は？",
+        "総理大臣は誰ですか？",
+        "ピザの作り方は？",
+        "おすすめの映画を教えてください",
+        "東京から大阪まで何時間かかりますか？",
+    ],
+}
+
+# Share of requests drawn from each pool: "<language>_in" are knowledge base
+# questions, "<language>_out" are unrelated questions.
+MIXES = {
+    'en': {'en_in': 1.0},
+    'jp': {'jp_in': 1.0},
+    'mixed': {'en_in': 0.4, 'jp_in': 0.3, 'en_out': 0.15, 'jp_out': 0.15},
+    'out_of_context': {'en_out': 0.5, 'jp_out': 0.5},
+}
+
+
+def query_pools() -> Dict[str, List[str]]:
+    pools = {}
+    for language in ('en', 'jp'):
+        entries = KnowledgeStore(os.path.join(DATA_DIR, f'{language}.jsonl')).entries()
+        pools[f'{language}_in'] = [item['question'] for item in entries]
+        pools[f'{language}_out'] = list(OUT_OF_CONTEXT[language])
+    return pools
+
+
+def build_workload(mix: str, cache: str, requests: int, seed: int = 0,
+                   pools: Optional[Dict[str, List[str]]] = None, tag: str = '') -> List[Tuple[str, str]]:
+    """`(message, language)` pairs for one run.
+
+    With cache="hit" messages repeat verbatim and are answered from the
+    response cache once warmed. With cache="miss" each one carries `tag` and
+    its request number, so no two requests of a process share a response
+    cache entry (the semantic cache may still match near-duplicates, as it
+    would for paraphrases).
+    """
+    pools = pools or query_pools()
+    rng = random.Random(seed)
+    kinds = list(MIXES[mix])
+    weights = [MIXES[mix][kind] for kind in kinds]
+    workload = []
+    for i in range(requests):
+        kind = rng.choices(kinds, weights)[0]
+        message = rng.choice(pools[kind])
+        if cache == 'miss':
+            message = f"{message} ({tag}{i})"
+        workload.append((message, kind.split('_')[0]))
+    return workload
+
+
+def warmup_workload(mix: str, pools: Dict[str, List[str]]) -> List[Tuple[str, str]]:
+    """Every distinct message a cache="hit" run of `mix` can draw."""
+    return [(message, kind.split('_')[0]) for kind in MIXES[mix] for message in pools[kind]]
+
+
+async def drive(client: httpx.AsyncClient, workload: Sequence[Tuple[str, str]],
+                concurrency: int) -> Tuple[List[float], Counter, float]:
+    """Send `workload` with `concurrency` requests in flight; latencies are in ms."""
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    pending = iter(workload)
+
+    async def worker():
+        for message, language in pending:
+            start = time.perf_counter()
+            try:
+                response = await client.post('/api/chat', json={'message': message, 'language': language})
+            except httpx.HTTPError:
+                statuses['error'] += 1
+                continue
+            latencies.append((time.perf_counter() - start) * 1000.0)
+            statuses[response.status_code] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def _percentile(latencies: List[float], q: float) -> float:
+    return float(np.percentile(latencies, q)) if latencies else 0.0
+
+
+class Target(ABC):
+    """Where requests go, and which processes' memory is reported."""
+
+    name = ''
+
+    @abstractmethod
+    def client(self, concurrency: int) -> httpx.AsyncClient:
+        """A client for one run at `concurrency`."""
+
+    @abstractmethod
+    def memory(self) -> Dict[str, float]:
+        """`rss_mb` and `pss_mb` of the processes serving requests."""
+
+    def close(self):
+        pass
+
+
+class InProcessTarget(Target):
+    name = 'inprocess'
+
+    def __init__(self):
+        import main
+
+        self.app = main.app
+
+    def client(self, concurrency: int) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app), base_url='http://loadtest',
+                                 timeout=None)
+
+    def memory(self) -> Dict[str, float]:
+        return memory_mb(os.getpid())
+
+
+class ServerTarget(Target):
+    """`uvicorn main:app --workers N` or serve.py's pre-fork server on a local port."""
+
+    def __init__(self, name: str, port: int, workers: int = 1, timeout: float = 600.0):
+        self.name = name
+        self.port = port
+        env = dict(os.environ, WEB_WORKERS=str(workers), HOST='127.0.0.1', PORT=str(port))
+        if name == 'prefork':
+            command = [sys.executable, os.path.join(_HERE, 'serve.py')]
+        else:
+            command = [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1',
+                       '--port', str(port), '--workers', str(workers), '--log-level', 'warning']
+        self.proc = subprocess.Popen(command, cwd=_HERE, env=env,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"{name} server exited with status {self.proc.returncode}")
+            try:
+                if httpx.get(f'http://127.0.0.1:{port}/api/health', timeout=1.0).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                self.close()
+                raise RuntimeError(f"{name} server not ready after {timeout:.0f}s")
+            time.sleep(0.5)
+
+    def client(self, concurrency: int) -> httpx.AsyncClient:
+        return httpx.AsyncClient(base_url=f'http://127.0.0.1:{self.port}', timeout=120.0,
+                                 limits=httpx.Limits(max_connections=concurrency))
+
+    def memory(self) -> Dict[str, float]:
+        usage = [memory_mb(pid) for pid in [self.proc.pid] + worker_pids(self.proc.pid)]
+        return {'rss_mb': sum(u['rss_mb'] for u in usage), 'pss_mb': sum(u['pss_mb'] for u in usage)}
+
+    def close(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+async def run(target: Target, mix: str, cache: str, concurrency: int, requests: int,
+              warmup: int = 20, seed: int = 0, pools: Optional[Dict[str, List[str]]] = None) -> Dict:
+    """One measured run; warmup requests (and, for cache hits, every distinct message) go first."""
+    pools = pools or query_pools()
+    # Numbers only, so the tag adds no words that BM25 or keywords could match.
+    tag = f"{list(MIXES).index(mix)}.{concurrency}."
+    workload = build_workload(mix, cache, requests, seed, pools, tag)
+    if cache == 'hit':
+        primer = warmup_workload(mix, pools)
+    else:
+        primer = build_workload(mix, 'miss', warmup, seed + 1, pools, '0.' + tag)
+    async with target.client(concurrency) as client:
+        await drive(client, primer, concurrency)
+        before = target.memory()
+        latencies, statuses, elapsed = await drive(client, workload, concurrency)
+    after = target.memory()
+    ok = statuses.get(200, 0)
+    return {
+        'target': target.name,
+        'mix': mix,
+        'cache': cache,
+        'concurrency': concurrency,
+        'requests': requests,
+        'ok': ok,
+        'rejected': statuses.get(503, 0),
+        'errors': requests - ok - statuses.get(503, 0),
+        'duration_s': elapsed,
+        'throughput_rps': ok / elapsed if elapsed > 0 else 0.0,
+        'mean_ms': float(np.mean(latencies)) if latencies else 0.0,
+        'p50_ms': _percentile(latencies, 50),
+        'p95_ms': _percentile(latencies, 95),
+        'p99_ms': _percentile(latencies, 99),
+        'rss_mb_before': before['rss_mb'],
+        'rss_mb_after': after['rss_mb'],
+        'pss_mb_after': after['pss_mb'],
+    }
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=_HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _key(row: Dict) -> Tuple:
+    return row['target'], row['mix'], row['cache'], row['concurrency']
+
+
+def compare(baseline: Dict, current: Dict) -> List[str]:
+    """Throughput and tail latency change of each run present in both reports."""
+    previous = {_key(row): row for row in baseline['results']}
+    lines = []
+    for row in current['results']:
+        old = previous.get(_key(row))
+        if old is None:
+            continue
+        change = lambda field: (row[field] - old[field]) / old[field] * 100.0 if old[field] else 0.0
+        lines.append(f"{'/'.join(map(str, _key(row))):<32} throughput {change('throughput_rps'):+6.1f}%  "
+                     f"p95 {change('p95_ms'):+6.1f}%  p99 {change('p99_ms'):+6.1f}%  "
+                     f"RSS {row['rss_mb_after'] - old['rss_mb_after']:+.0f} MB")
+    return lines
+
+
+def _format(row: Dict) -> str:
+    return (f"{row['target']:<9} {row['mix']:<14} {row['cache']:<4} c={row['concurrency']:<3} "
+            f"{row['throughput_rps']:7.1f} req/s  p50={row['p50_ms']:7.1f}ms  p95={row['p95_ms']:7.1f}ms  "
+            f"p99={row['p99_ms']:7.1f}ms  RSS {row['rss_mb_after']:.0f} MB  "
+            f"ok={row['ok']} 503={row['rejected']} err={row['errors']}")
+
+
+def main(argv: Optional[Sequence[str]] = None) -> Dict:
+    parser = argparse.ArgumentParser(description="Load test /api/chat")
+    parser.add_argument('--target', nargs='+', default=['inprocess'], choices=['inprocess', 'uvicorn', 'prefork'])
+    parser.add_argument('--workers', type=int, default=1, help="server workers for uvicorn / prefork")
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument('--mix', nargs='+', default=['mixed'], choices=list(MIXES))
+    parser.add_argument('--cache', nargs='+', default=['miss', 'hit'], choices=['miss', 'hit'])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--output', help="JSON report path (default loadtest-<commit>.json)")
+    parser.add_argument('--compare', help="earlier JSON report to diff against")
+    args = parser.parse_args(argv)
+
+    commit = _commit()
+    pools = query_pools()
+    report = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': [],
+    }
+    for name in args.target:
+        target = InProcessTarget() if name == 'inprocess' else ServerTarget(name, args.port, args.workers)
+        try:
+            for mix in args.mix:
+                for cache in args.cache:
+                    for concurrency in args.concurrency:
+                        row = asyncio.run(run(target, mix, cache, concurrency, args.requests,
+                                              args.warmup, args.seed, pools))
+                        report['results'].append(row)
+                        print(_format(row), flush=True)
+        finally:
+            target.close()
+
+    output = args.output or os.path.join(os.getcwd(), f'loadtest-{commit}.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"Compared with {baseline.get('commit')} ({args.compare}):")
+        for line in compare(baseline, report):
+            print(f"  {line}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,90 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
-import sys
 import os
-import ast
-from typing import Optional, List, Dict
 import json
-import importlib.util
-import re
+from typing import Optional, List, Dict, Literal
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
+import En
+import Jp
 from En import (initialize_bot as initialize_en_bot, enhanced_chat_response as en_chat_response)
 from Jp import (initialize_bot as initialize_jp_bot, enhanced_chat_response as jp_chat_response)
+from image_cache import file_etag, servable_image_path, image_cache, url_version
+from response_cache import ResponseCache, normalize_query
+from observability import fields, get_logger, render_metrics, timed
+
+log = get_logger('main')
 
 try:
     initialize_en_bot()
     initialize_jp_bot()
-except Exception as e:
-    print(f"Error initializing bots: {str(e)}")
+except Exception:
+    log.exception("bot initialization failed")
+
+# Chat inference runs on a bounded thread pool so the event loop stays free
+# for health probes and I/O. Requests beyond workers + queue are rejected.
+CHAT_MAX_WORKERS = int(os.getenv("CHAT_MAX_WORKERS", "4"))
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "32"))
+CHAT_RETRY_AFTER = int(os.getenv("CHAT_RETRY_AFTER", "1"))
+# Default for ChatRequest.image_mode: 'base64' inlines images, 'url' links to /api/images
+CHAT_IMAGE_MODE = os.getenv("CHAT_IMAGE_MODE", "base64")
+# Most messages accepted by one /api/chat/batch request
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "256"))
+# A batch runs as pool jobs of at most this many same-language messages,
+# each taking one admission slot like a single /api/chat request
+CHAT_BATCH_JOB_SIZE = int(os.getenv("CHAT_BATCH_JOB_SIZE", "16"))
+
+class ChatWorkerPool:
+    """Thread pool with a bounded admission queue for blocking chat work."""
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat")
+        self.capacity = max_workers + max_queue
+        self.pending = 0  # only touched from the event loop thread
+
+    async def run(self, fn, *args):
+        self.reserve(1)
+        return await self.submit_reserved(fn, *args)
+
+    def reserve(self, jobs: int):
+        """Admit `jobs` jobs at once or none of them."""
+        if self.pending + jobs > self.capacity:
+            raise HTTPException(
+                status_code=503,
+                detail="Chat service is busy, please retry shortly",
+                headers={"Retry-After": str(CHAT_RETRY_AFTER)},
+            )
+        self.pending += jobs
+
+    def submit_reserved(self, fn, *args) -> asyncio.Future:
+        """Start one job admitted by `reserve`.
+
+        Its slot is freed when the job itself finishes, not when the caller
+        stops waiting: a cancelled request (e.g. a client disconnect) cancels
+        the awaitable but not the thread already running the job.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            job = self.executor.submit(fn, *args)
+        except BaseException:
+            self.pending -= 1
+            raise
+        job.add_done_callback(lambda _job: loop.call_soon_threadsafe(self._release))
+        return asyncio.wrap_future(job, loop=loop)
+
+    def _release(self):
+        self.pending -= 1
+
+    async def run_admitted(self, fn, *args):
+        """Follow-up work for a request that already passed admission (never rejected)."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+chat_pool = ChatWorkerPool(CHAT_MAX_WORKERS, CHAT_MAX_QUEUE)
+response_cache = ResponseCache()
 
 app = FastAPI()
 
@@ -31,106 +99,291 @@ app.add_middleware(
 class ChatRequest(BaseModel):
     message: str
     language: str = 'en' 
+    image_mode: Optional[Literal['base64', 'url']] = None
 
 class ChatResponse(BaseModel):
     response: str
     image_base64: Optional[str]
+    image_url: Optional[str] = None
     confidence: str
     related_topics: list[str]
 
+class ChatBatchItem(BaseModel):
+    message: str
+    language: str = 'en'
+
+class ChatBatchRequest(BaseModel):
+    items: List[ChatBatchItem]
+    image_mode: Optional[Literal['base64', 'url']] = None
+
+class ChatBatchResult(BaseModel):
+    response: Optional[str] = None
+    image_base64: Optional[str] = None
+    image_url: Optional[str] = None
+    confidence: Optional[str] = None
+    related_topics: list[str] = []
+    error: Optional[str] = None
+
+class ChatBatchResponse(BaseModel):
+    results: List[ChatBatchResult]
+
 class DatasetEntry(BaseModel):
     question: str
     answer: str
     category: str
     image_path: Optional[str]
     related_topics: list[str]
+    keywords: list[str] = []
 
 class DatasetUpdateRequest(BaseModel):
     data: DatasetEntry
     language: str
 
-@app.post("/api/chat")
-async def chat(request: ChatRequest) -> ChatResponse:
+async def _kb_version(bot) -> Optional[int]:
+    """Version of `bot`'s knowledge base, after picking up dataset changes made by other workers.
+
+    Every worker of a pre-forked or multi-worker deployment holds its own
+    snapshot and response cache; a changed JSONL store (one stat call to
+    notice) rebuilds the snapshot, and the new version retires cached answers.
+    """
+    if bot.kb is None:
+        return None
+    if bot.kb.store_changed():
+        await chat_pool.run_admitted(bot.kb.refresh)
+    return bot.kb.version
+
+@app.post("/api/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest) -> Response:
     try:
-        if request.language == 'jp':
-            print(f"Processing Japanese query: {request.message}")
-            result = jp_chat_response(request.message)
-            print(f"Japanese response: {result}")
+        image_mode = request.image_mode or CHAT_IMAGE_MODE
+        language = 'jp' if request.language == 'jp' else 'en'
+        bot = Jp if language == 'jp' else En
+        with timed('total', language):
+            # Keyed on the normalized question; the KB version invalidates on updates
+            with timed('normalize', language):
+                cache_key = (language, image_mode, normalize_query(request.message))
+            version = await _kb_version(bot)
+            result = response_cache.get(cache_key, version)
+            log.debug("chat request", extra=fields(language=language, message=request.message,
+                                                   cached=result is not None))
+            if result is None:
+                result = await chat_pool.run(jp_chat_response if language == 'jp' else en_chat_response,
+                                             request.message, image_mode)
+                log.debug("chat response", extra=fields(language=language, response=result['response'],
+                                                        confidence=result.get('confidence'),
+                                                        error=result.get('error', False)))
+                if not result.get('error'):
+                    response_cache.put(cache_key, version, result)
+
+            # Serialized here rather than by FastAPI so the cost shows up as its own stage
+            with timed('serialize', language):
+                body = ChatResponse(
+                    response=result['response'],
+                    image_base64=result['image_base64'],
+                    image_url=result.get('image_url'),
+                    confidence=result['confidence'],
+                    related_topics=result['related_topics']
+                ).model_dump_json()
+        return Response(body, media_type="application/json")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Server-Sent Events variant of /api/chat.
+
+    Emits `answer` (response, related_topics) as soon as retrieval finishes,
+    then `image` (image_base64 / image_url and the confidence, which depends
+    on whether the image could be delivered), then `done`. A failure while
+    preparing the image is sent as an `error` event.
+    """
+    image_mode = request.image_mode or CHAT_IMAGE_MODE
+    language = 'jp' if request.language == 'jp' else 'en'
+    bot = Jp if language == 'jp' else En
+    with timed('normalize', language):
+        cache_key = (language, image_mode, normalize_query(request.message))
+    version = await _kb_version(bot)
+    cached = response_cache.get(cache_key, version)
+    log.debug("chat stream request", extra=fields(language=language, message=request.message,
+                                                  cached=cached is not None))
+    answer = cached
+    if answer is None:
+        # Retrieval runs before the stream opens, so overload and errors keep their status codes
+        try:
+            answer = await chat_pool.run(bot.chat_answer, request.message)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        yield _sse('answer', {'response': answer['response'], 'related_topics': answer['related_topics']})
+        image = cached
+        if image is None:
+            try:
+                image = await chat_pool.run_admitted(bot.chat_image, answer['image_path'],
+                                                     answer['related_topics'], image_mode)
+            except Exception as e:
+                log.exception("chat stream image failed", extra=fields(language=language))
+                yield _sse('error', {'detail': str(e)})
+                return
+            image = dict(image, confidence=bot.chat_confidence(answer, image))
+            # Stored in the shape /api/chat caches, so both endpoints share
+            # entries; an answer whose image could not be delivered is not kept
+            if not answer['image_path'] or image['image_base64'] or image['image_url']:
+                response_cache.put(cache_key, version, dict(answer, **image))
+        yield _sse('image', {'image_base64': image['image_base64'], 'image_url': image.get('image_url'),
+                             'confidence': image['confidence']})
+        yield _sse('done', {})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def answer_batch(items: List[ChatBatchItem], image_mode: str = CHAT_IMAGE_MODE) -> List[Dict]:
+    """Results for `items` in order, each with an `error` message or None.
+
+    Cached answers are reused; the rest are grouped per language and split
+    into jobs of up to CHAT_BATCH_JOB_SIZE messages, each retrieved as one
+    batch (one encoder call, one index search) on the chat pool. Every job's
+    admission slot is reserved before any starts, so a busy pool rejects the
+    batch (503) without doing part of it. A job that fails marks its items
+    as errors.
+    """
+    results: List[Optional[Dict]] = [None] * len(items)
+    groups: Dict[str, List[tuple]] = {}
+    versions: Dict[str, Optional[int]] = {}
+    for i, item in enumerate(items):
+        language = 'jp' if item.language == 'jp' else 'en'
+        bot = Jp if language == 'jp' else En
+        cache_key = (language, image_mode, normalize_query(item.message))
+        if language not in versions:
+            versions[language] = await _kb_version(bot)
+        version = versions[language]
+        cached = response_cache.get(cache_key, version)
+        if cached is not None:
+            results[i] = dict(cached, error=None)
         else:
-            result = en_chat_response(request.message)
-            
-        return ChatResponse(
-            response=result['response'],
-            image_base64=result['image_base64'],
-            confidence=result['confidence'],
-            related_topics=result['related_topics']
-        )
+            groups.setdefault(language, []).append((i, cache_key, version))
+    log.debug("chat batch request", extra=fields(items=len(items), cached=len(items) - sum(map(len, groups.values())),
+                                                 groups={language: len(members) for language, members in groups.items()}))
+
+    jobs = [(language, members[start:start + CHAT_BATCH_JOB_SIZE])
+            for language, members in groups.items()
+            for start in range(0, len(members), CHAT_BATCH_JOB_SIZE)]
+    if len(jobs) > chat_pool.capacity:
+        raise HTTPException(status_code=413, detail=f"Batch needs {len(jobs)} jobs of {CHAT_BATCH_JOB_SIZE} messages, "
+                                                    f"more than the {chat_pool.capacity} the chat pool admits")
+    chat_pool.reserve(len(jobs))
+    futures = [chat_pool.submit_reserved((Jp if language == 'jp' else En).batch_chat_response,
+                                         [items[i].message for i, _, _ in members], image_mode)
+               for language, members in jobs]
+    for (language, members), answers in zip(jobs, await asyncio.gather(*futures, return_exceptions=True)):
+        if isinstance(answers, BaseException):
+            log.error("chat batch failed", exc_info=answers, extra=fields(language=language, items=len(members)))
+            answers = [{'response': None, 'error': str(answers)}] * len(members)
+        for (i, cache_key, version), result in zip(members, answers):
+            if result.get('error'):
+                result = dict(result, error=result['error'] if isinstance(result['error'], str)
+                              else "chat response failed")
+            else:
+                response_cache.put(cache_key, version, result)
+                result = dict(result, error=None)
+            results[i] = result
+    return results
+
+@app.post("/api/chat/batch", response_model=ChatBatchResponse)
+async def chat_batch(request: ChatBatchRequest) -> Response:
+    """Answer many messages in one call; results come back in request order with per-item errors."""
+    if len(request.items) > CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413,
+                            detail=f"At most {CHAT_BATCH_MAX_ITEMS} items per batch, got {len(request.items)}")
+    try:
+        with timed('batch_total'):
+            results = await answer_batch(request.items, request.image_mode or CHAT_IMAGE_MODE)
+            with timed('batch_serialize'):
+                body = ChatBatchResponse(results=[ChatBatchResult(
+                    response=result.get('response'),
+                    image_base64=result.get('image_base64'),
+                    image_url=result.get('image_url'),
+                    confidence=result.get('confidence'),
+                    related_topics=result.get('related_topics') or [],
+                    error=result.get('error')
+                ) for result in results]).model_dump_json()
+        return Response(body, media_type="application/json")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/get_data")
 async def get_data(language: str = "en"):
+    bot = Jp if language == 'jp' else En
     try:
-        file_path = os.path.join(os.path.dirname(__file__), 'Jp.py' if language == 'jp' else 'En.py')
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        match = re.search(r'business_data\s*=\s*(\[[\s\S]*?\n\])', content)
-        if not match:
-            raise HTTPException(status_code=400, detail="Could not find business_data in the file")
-        
-        data_str = match.group(1)
-        business_data = ast.literal_eval(data_str)
-        return business_data
+        # Served from memory: the live snapshot, or the store's parsed cache
+        if bot.kb is None:
+            return bot.store.entries()
+        await _kb_version(bot)
+        return bot.kb.data
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/update_data")
-async def update_dataset(request: DatasetUpdateRequest):
+def update_dataset(request: DatasetUpdateRequest):
+    # Plain def: FastAPI runs it on its threadpool, so embedding the new entry
+    # never blocks the event loop.
     try:
-        file_path = os.path.join(os.path.dirname(__file__), 
-                               'Jp.py' if request.language == 'jp' else 'En.py')
-        
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        data_start = content.find('business_data = [')
-        if data_start == -1:
-            raise HTTPException(status_code=400, detail="Could not find business_data in the file")
-        
-        data_end = content.find(']', data_start)
-        if data_end == -1:
-            raise HTTPException(status_code=400, detail="Could not parse business_data")
-        
-        new_entry = f"""    {{
-        "question": {json.dumps(request.data.question, ensure_ascii=False)},
-        "answer": {json.dumps(request.data.answer, ensure_ascii=False)},
-        "category": {json.dumps(request.data.category, ensure_ascii=False)},
-        "image_path": {json.dumps(request.data.image_path, ensure_ascii=False)},
-        "related_topics": {json.dumps(request.data.related_topics, ensure_ascii=False)}
-    }},\n"""
-        
-        updated_content = (
-            content[:data_start + len('business_data = [')] +
-            '\n' + new_entry +
-            content[data_start + len('business_data = ['):]
-        )
-        
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(updated_content)
-        
-        if request.language == 'jp':
-            importlib.reload(sys.modules['Jp'])
-            initialize_jp_bot()
-        else:
-            importlib.reload(sys.modules['En'])
-            initialize_en_bot()
+        bot = Jp if request.language == 'jp' else En
+        if bot.kb is None:
+            raise HTTPException(status_code=503, detail="Chatbot not initialized")
+        # Appends to the language's JSONL store and the live indices together
+        bot.kb.add_entry(request.data.model_dump())
         
         return {"status": "success"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/images/{name}")
+def get_image(name: str, request: Request, v: Optional[str] = None):
+    path = servable_image_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    digest = file_etag(path)
+    etag = f'"{digest}"'
+    # Versioned URLs (as returned by /api/chat) never change content; bare
+    # ones, and any other `v`, must be revalidated against the ETag.
+    cache_control = ("public, max-age=31536000, immutable" if v == url_version(digest)
+                     else "public, no-cache")
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, headers=headers)
+
+@app.get("/api/cache_stats")
+async def cache_stats():
+    return {
+        "response_cache": response_cache.stats(),
+        "image_cache": {"size": len(image_cache), "hits": image_cache.hits, "misses": image_cache.misses},
+        "semantic_cache": {
+            language: bot.kb.semantic_cache.stats()
+            for language, bot in (('en', En), ('jp', Jp))
+            if bot.kb is not None and bot.kb.semantic_cache is not None
+        },
+    }
+
+@app.get("/api/metrics")
+async def metrics():
+    # Prometheus text exposition format
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/api/health")
 async def health_check():
     return {"status": "ok"}
\ No newline at end of file
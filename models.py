@@ -0,0 +1,217 @@
+import os
+import time
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from observability import fields, get_logger
+
+log = get_logger('models')
+
+# The chatbots answer with retrieved text verbatim, so the T5 generators are
+# only loaded when generative mode is switched on explicitly.
+GENERATIVE_MODE = os.getenv("CHAT_GENERATIVE_MODE", "0") == "1"
+# Load embedding models during initialize_bot instead of on the first query.
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "0") == "1"
+# When set (e.g. sentence-transformers/paraphrase-multilingual-mpnet-base-v2),
+# every language uses this one embedding model and one partitioned index.
+SHARED_EMBEDDING_MODEL = os.getenv("SHARED_EMBEDDING_MODEL", "") or None
+# Encoder used for queries: "fp32", "int8" (torch dynamic quantization of the
+# Linear layers) or "onnx" (sentence-transformers' ONNX backend, which needs
+# optimum[onnxruntime]). Entry embeddings are always computed with fp32 so the
+# on-disk embedding cache stays valid whichever is chosen.
+QUERY_ENCODER = os.getenv("QUERY_ENCODER", "fp32")
+
+_lock = threading.Lock()
+_embedding_models: Dict[Tuple[str, str], object] = {}
+_generators: Dict[str, Tuple[object, object]] = {}
+_lazy_models: Dict[Tuple[str, str], 'LazyEmbeddingModel'] = {}
+
+
+def _load_sentence_transformer(name: str, variant: str):
+    from sentence_transformers import SentenceTransformer
+
+    if variant == 'fp32':
+        return SentenceTransformer(name)
+    if variant == 'int8':
+        import torch
+
+        model = SentenceTransformer(name, device='cpu')
+        torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        return model
+    if variant == 'onnx':
+        return SentenceTransformer(name, backend='onnx')
+    raise ValueError(f"Unknown encoder variant: {variant}")
+
+
+def get_embedding_model(name: str, variant: str = 'fp32'):
+    """Load a SentenceTransformer once per process and share it."""
+    with _lock:
+        if (name, variant) not in _embedding_models:
+            log.info("loading embedding model", extra=fields(model=name, variant=variant))
+            start = time.perf_counter()
+            _embedding_models[name, variant] = _load_sentence_transformer(name, variant)
+            log.info("loaded embedding model", extra=fields(model=name, variant=variant,
+                                                            seconds=round(time.perf_counter() - start, 2)))
+        return _embedding_models[name, variant]
+
+
+def get_generator(name: str) -> Tuple[object, object]:
+    """Load a T5 model and tokenizer once per process and share them."""
+    with _lock:
+        if name not in _generators:
+            from transformers import T5ForConditionalGeneration, T5Tokenizer
+
+            log.info("loading generator", extra=fields(model=name))
+            start = time.perf_counter()
+            tokenizer = T5Tokenizer.from_pretrained(name)
+            model = T5ForConditionalGeneration.from_pretrained(name)
+            model.eval()
+            _generators[name] = (model, tokenizer)
+            log.info("loaded generator", extra=fields(model=name, seconds=round(time.perf_counter() - start, 2)))
+        return _generators[name]
+
+
+def load_generator(name: str) -> Tuple[Optional[object], Optional[object]]:
+    """`(model, tokenizer)` in generative mode, `(None, None)` otherwise."""
+    if not GENERATIVE_MODE:
+        return None, None
+    return get_generator(name)
+
+
+class LazyEmbeddingModel:
+    """Stands in for a SentenceTransformer and loads it on first use.
+
+    With the on-disk embedding cache warm, a process can build its indices and
+    answer health checks without importing torch at all.
+    """
+
+    def __init__(self, name: str, variant: str = 'fp32'):
+        self.name = name
+        self.variant = variant
+        self._model = None
+
+    def load(self):
+        if self._model is None:
+            self._model = get_embedding_model(self.name, self.variant)
+        return self._model
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def encode(self, *args, **kwargs):
+        return self.load().encode(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+def embedding_model_for(name: str, variant: str = 'fp32') -> LazyEmbeddingModel:
+    """The process-wide lazy handle for `name`, shared by every bot using it."""
+    with _lock:
+        if (name, variant) not in _lazy_models:
+            _lazy_models[name, variant] = LazyEmbeddingModel(name, variant)
+        return _lazy_models[name, variant]
+
+
+def query_model_for(name: str) -> LazyEmbeddingModel:
+    """Handle used to embed queries; the fp32 handle itself unless QUERY_ENCODER says otherwise."""
+    return embedding_model_for(name, QUERY_ENCODER)
+
+
+def _rss_mb() -> float:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def compare_query_encoders(name: str, index, questions: List[str],
+                           variants: Sequence[str] = ('fp32', 'int8', 'onnx'), k: int = 3) -> List[Dict]:
+    """Latency, memory and retrieval agreement of each query encoder against fp32.
+
+    Questions are encoded one at a time, as live queries are, and searched in
+    `index`. `load_rss_mb` is the resident memory added by loading that
+    variant, so it depends on what the process had already loaded.
+    """
+    import faiss
+    import numpy as np
+
+    rows: List[Dict] = []
+    reference = None
+    for variant in ['fp32'] + [v for v in variants if v != 'fp32']:
+        rss = _rss_mb()
+        start = time.perf_counter()
+        try:
+            model = get_embedding_model(name, variant)
+        except Exception as e:
+            # Optional backends (onnx needs optimum + onnxruntime) may be missing.
+            if variant == 'fp32':
+                raise
+            rows.append({'variant': variant, 'error': str(e)})
+            continue
+        load_s = time.perf_counter() - start
+        load_rss_mb = _rss_mb() - rss
+        model.encode(questions[:1])
+
+        latencies, vectors = [], []
+        for q in questions:
+            t0 = time.perf_counter()
+            vectors.append(model.encode([q]))
+            latencies.append((time.perf_counter() - t0) * 1000)
+        emb = np.ascontiguousarray(np.vstack(vectors), dtype='float32')
+        faiss.normalize_L2(emb)
+        _, ids = index.search(emb, k)
+        if reference is None:
+            reference = (emb, ids)
+        ref_emb, ref_ids = reference
+        rows.append({
+            'variant': variant,
+            'load_s': load_s,
+            'load_rss_mb': load_rss_mb,
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'top1_agreement': float(np.mean(ids[:, 0] == ref_ids[:, 0])),
+            f'top{k}_overlap': float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, ref_ids)])),
+            'mean_cosine_to_fp32': float(np.mean(np.sum(emb * ref_emb, axis=1))),
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:] == ['encoders']:
+        # Query encoder comparison over each knowledge base's own questions.
+        import En
+        import Jp
+
+        for bot in (En, Jp):
+            bot.initialize_bot()
+            questions = [item['question'] for item in bot.kb.data]
+            print(f"{bot.embedding_model_name} ({len(questions)} questions)")
+            for row in compare_query_encoders(bot.embedding_model_name, bot.kb.index, questions):
+                if 'error' in row:
+                    print(f"  {row['variant']:<5} unavailable: {row['error']}")
+                    continue
+                print(f"  {row['variant']:<5} p50={row['p50_ms']:.1f}ms p95={row['p95_ms']:.1f}ms  "
+                      f"load {row['load_s']:.1f}s +{row['load_rss_mb']:.0f} MB  "
+                      f"top1={row['top1_agreement']:.1%} top3={row['top3_overlap']:.1%}  "
+                      f"cos={row['mean_cosine_to_fp32']:.4f}")
+        sys.exit(0)
+
+    # Startup profile: time and resident memory to import the API and to
+    # answer the first query in each language.
+    start = time.perf_counter()
+    import main
+    booted = time.perf_counter()
+    print(f"API import + initialize_bot: {booted - start:.2f}s, RSS {_rss_mb():.0f} MB")
+    for language, question in (('en', 'What does Visual Alpha do?'), ('jp', 'ビジュアルアルファとは')):
+        t0 = time.perf_counter()
+        (main.jp_chat_response if language == 'jp' else main.en_chat_response)(question)
+        print(f"first {language} query: {time.perf_counter() - t0:.2f}s, RSS {_rss_mb():.0f} MB")
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# Level of the application's JSON-lines log on stderr. Per-query events are
+# logged at DEBUG, so the default only shows warnings and errors.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, event and its `fields`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_logger = logging.getLogger('chatbot')
+if not _logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(JsonFormatter())
+    _logger.addHandler(_handler)
+    _logger.setLevel(LOG_LEVEL)
+    _logger.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    return _logger.getChild(name)
+
+
+def fields(**values) -> Dict:
+    """`extra=` argument attaching structured fields to a log record."""
+    return {'fields': values}
+
+
+class Histogram:
+    """Thread-safe histogram rendered in the Prometheus text exposition format.
+
+    Each distinct tuple of label values is its own series.
+    """
+
+    def __init__(self, name: str, description: str, labels: Sequence[str],
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Per series: a count per bucket (the last one is +Inf), then the sum.
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bucket] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(snapshot.items()):
+            labels = ''.join(f'{key}="{value}",' for key, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip([f"{b:g}" for b in self.buckets] + ['+Inf'], series[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels.rstrip(",")}}} {series[-1]}')
+            lines.append(f'{self.name}_count{{{labels.rstrip(",")}}} {cumulative}')
+        return lines
+
+
+STAGE_SECONDS = Histogram('chat_stage_duration_seconds', 'Time spent in each stage of a chat request.',
+                          ('stage', 'language'))
+
+
+@contextmanager
+def timed(stage: str, language: str = '') -> Iterator[None]:
+    """Record the duration of the enclosed block as `stage` in STAGE_SECONDS."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage, language)
+
+
+def render_metrics() -> str:
+    return '\n'.join(STAGE_SECONDS.render()) + '\n'
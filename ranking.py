@@ -0,0 +1,38 @@
+import os
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# Candidates taken from each retriever before fusion.
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "10"))
+# Reciprocal rank fusion constant; larger values flatten the rank weighting.
+HYBRID_RRF_K = float(os.getenv("HYBRID_RRF_K", "60"))
+# The query embedding is skipped when the top curated keyword hit is also the
+# top BM25 hit and scores at least this many times the BM25 runner-up.
+# 0 disables the fast path.
+LEXICAL_FAST_PATH_RATIO = float(os.getenv("LEXICAL_FAST_PATH_RATIO", "2.0"))
+# Reported for the fallback keyword hit when the dense retriever did not rank it.
+KEYWORD_MATCH_SCORE = 0.6
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: float = HYBRID_RRF_K) -> List[int]:
+    """Entry ids from every ranking, ordered by summed 1 / (k + rank)."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking, 1):
+            fused[idx] = fused.get(idx, 0.0) + 1.0 / (k + rank)
+    return sorted(fused, key=lambda idx: fused[idx], reverse=True)
+
+
+def ranked_ids(indices: np.ndarray) -> List[int]:
+    """Valid ids from a `(1, k)` search result, in rank order."""
+    return [int(idx) for idx in indices[0] if idx >= 0]
+
+
+def lexical_is_decisive(keyword_matches: List[int], lex_scores: np.ndarray, lex_indices: np.ndarray,
+                        ratio: float = LEXICAL_FAST_PATH_RATIO) -> bool:
+    """Whether curated keywords and BM25 agree on a clear winner."""
+    if ratio <= 0 or not keyword_matches or lex_indices[0][0] != keyword_matches[0]:
+        return False
+    runner_up = lex_scores[0][1] if lex_indices.shape[1] > 1 and lex_indices[0][1] >= 0 else 0.0
+    return lex_scores[0][0] >= ratio * runner_up
@@ -0,0 +1,142 @@
+import os
+import threading
+from typing import List, Dict, Optional, Sequence
+
+import faiss
+import numpy as np
+
+# Recent query embeddings and their retrieval results. The lookup runs on the
+# embedding that search() gets back from the (micro-batched) embed-and-search
+# call, so keyword matching, BM25 and the index search have already run; a new
+# query whose cosine similarity to a cached one reaches SEMANTIC_CACHE_THRESHOLD
+# reuses that query's fused results instead of ranking its own.
+# SEMANTIC_CACHE_SIZE=0 disables the cache.
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "512"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+
+
+class SemanticCache:
+    """FIFO cache of query embeddings searched with a small inner-product index.
+
+    Entries are tied to the knowledge base version they were computed
+    against; the first lookup or store with a newer version empties the cache.
+    A `tag` (e.g. the search parameters) must also match for a hit.
+    """
+
+    def __init__(self, max_entries: int = SEMANTIC_CACHE_SIZE,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._index = None
+        self._values: Dict[int, object] = {}
+        self._next_id = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _reset(self, dim: int, version):
+        self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self._values = {}
+        self._version = version
+
+    def _check_version(self, dim: int, version):
+        if self._index is None or self._version != version or self._index.d != dim:
+            self._reset(dim, version)
+
+    def lookup(self, query_emb: np.ndarray, version, tag=None) -> Optional[object]:
+        """Cached value for the nearest stored query above the threshold, if any."""
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            self._check_version(query_emb.shape[1], version)
+            if self._index.ntotal:
+                scores, ids = self._index.search(query_emb, min(4, self._index.ntotal))
+                for score, entry_id in zip(scores[0], ids[0]):
+                    if score < self.threshold:
+                        break
+                    entry_tag, value = self._values[int(entry_id)]
+                    if entry_tag == tag:
+                        self.hits += 1
+                        return value
+            self.misses += 1
+            return None
+
+    def store(self, query_emb: np.ndarray, version, value, tag=None):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._check_version(query_emb.shape[1], version)
+            if self._index.ntotal >= self.max_entries:
+                oldest = min(self._values)
+                self._index.remove_ids(np.array([oldest], dtype='int64'))
+                del self._values[oldest]
+            self._index.add_with_ids(query_emb, np.array([self._next_id], dtype='int64'))
+            self._values[self._next_id] = (tag, value)
+            self._next_id += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._values),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _top_question(results: List[Dict]) -> Optional[str]:
+    return results[0]['question'] if results else None
+
+
+def evaluate(kb, queries: Sequence[str], thresholds: Sequence[float] = (0.85, 0.9, 0.95, 0.98)) -> List[Dict]:
+    """Leave-one-out hit and false-hit rates for a set of queries.
+
+    Each query is looked up in a cache holding every other query's uncached
+    search results. A hit is false when the cached top answer differs from
+    what the full retrieval path returns for that query.
+    """
+    saved, kb.semantic_cache = kb.semantic_cache, None
+    try:
+        truth = [kb.search(q) for q in queries]
+    finally:
+        kb.semantic_cache = saved
+    embeddings = [kb.embed_query(q) for q in queries]
+
+    report = []
+    for threshold in thresholds:
+        hits = false_hits = 0
+        for i in range(len(queries)):
+            cache = SemanticCache(max_entries=len(queries), threshold=threshold)
+            for j in range(len(queries)):
+                if j != i:
+                    cache.store(embeddings[j], None, truth[j])
+            cached = cache.lookup(embeddings[i], None)
+            if cached is not None:
+                hits += 1
+                if _top_question(cached) != _top_question(truth[i]):
+                    false_hits += 1
+        report.append({
+            'threshold': threshold,
+            'queries': len(queries),
+            'hit_rate': hits / len(queries) if queries else 0.0,
+            'false_hit_rate': false_hits / hits if hits else 0.0,
+        })
+    return report
+
+
+if __name__ == "__main__":
+    import En
+    import Jp
+
+    En.initialize_bot()
+    Jp.initialize_bot()
+    suites = [
+        ('en', En.kb, [item['question'] for item in En.kb.data]),
+        ('jp', Jp.kb, list(Jp.TEST_QUESTIONS) + [item['question'] for item in Jp.kb.data]),
+    ]
+    for language, kb, queries in suites:
+        for row in evaluate(kb, queries):
+            print(f"{language} threshold={row['threshold']:.2f}  queries={row['queries']}  "
+                  f"hit_rate={row['hit_rate']:.1%}  false_hit_rate={row['false_hit_rate']:.1%}")
@@ -0,0 +1,225 @@
+import os
+import gc
+import sys
+import time
+import json
+import signal
+import subprocess
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+# Pre-fork deployment: the API, its models and indices are loaded once in the
+# supervisor and WEB_WORKERS uvicorn workers are forked from it, so model
+# weights, FAISS indices and the embedding matrix are shared copy-on-write
+# rather than loaded again by every worker as with `uvicorn --workers`.
+# Each worker keeps its own snapshot and response cache; a dataset update
+# handled by one worker is picked up by the others from the JSONL store
+# (see main._kb_version) on their next request.
+#   python serve.py                      serve on HOST:PORT
+#   python serve.py measure [workers]    compare RSS / startup with uvicorn --workers
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1)))
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_READY = "Application startup complete."
+
+
+def _limit_threads(threads: int):
+    # Workers share the machine's cores; one torch / OpenMP pool per worker
+    # sized for all of them would oversubscribe the CPU.
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(threads)
+    import faiss
+
+    faiss.omp_set_num_threads(threads)
+
+
+def _run_worker(config, sock, threads: int):
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    _limit_threads(threads)
+    try:
+        uvicorn.Server(config).run(sockets=[sock])
+    finally:
+        os._exit(0)
+
+
+def serve(workers: int = WEB_WORKERS, host: str = HOST, port: int = PORT):
+    # Models must be resident before forking for the workers to share them.
+    os.environ.setdefault("PRELOAD_MODELS", "1")
+    start = time.perf_counter()
+    import uvicorn
+    import main
+
+    config = uvicorn.Config(main.app, host=host, port=port)
+    sock = config.bind_socket()
+    # Everything loaded so far lives as long as the process. Freezing it keeps
+    # the collector from touching those objects, which would otherwise copy
+    # their pages into each worker.
+    gc.collect()
+    gc.freeze()
+    print(f"Loaded API in {time.perf_counter() - start:.1f}s, forking {workers} workers")
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    children: Dict[int, float] = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(config, sock, threads)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if stopping or started is None:
+            continue
+        print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+        if time.monotonic() - started < 1.0:
+            # Don't spin on a worker that fails during startup.
+            time.sleep(1.0)
+        spawn()
+    sock.close()
+
+
+def child_pids(pid: int) -> List[int]:
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def _is_worker(pid: int) -> bool:
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            return b'resource_tracker' not in f.read()
+    except OSError:
+        return False
+
+
+def worker_pids(pid: int) -> List[int]:
+    """Worker processes of server `pid`, skipping multiprocessing's resource tracker."""
+    return [child for child in child_pids(pid) if _is_worker(child)]
+
+
+def memory_mb(pid: int) -> Dict[str, float]:
+    """Resident and proportional set size; PSS splits shared pages between their users."""
+    usage = {'rss_mb': 0.0, 'pss_mb': 0.0}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                field = line.split(':')[0]
+                if field in ('Rss', 'Pss'):
+                    usage[f'{field.lower()}_mb'] = int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return usage
+
+
+def _chat(port: int, message: str, language: str):
+    body = json.dumps({'message': message, 'language': language}).encode('utf-8')
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/api/chat', data=body,
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=120) as response:
+        response.read()
+
+
+def _questions() -> List[tuple]:
+    questions = []
+    for language in ('en', 'jp'):
+        with open(os.path.join(_HERE, 'data', f'{language}.jsonl'), encoding='utf-8') as f:
+            questions.extend((json.loads(line)['question'], language) for line in f if line.strip())
+    return questions
+
+
+def measure(mode: str, workers: int, port: int, requests: int = 200, timeout: float = 600.0) -> Dict:
+    """Startup time and per-worker memory of one deployment mode.
+
+    `mode` is "prefork" (this module) or "uvicorn" (`uvicorn main:app --workers`).
+    Startup time runs until every worker has logged that it is ready. Memory is
+    sampled once all workers are up and again after `requests` chat requests;
+    the supervisor's own memory is included in the totals.
+    """
+    env = dict(os.environ, PRELOAD_MODELS="1", WEB_WORKERS=str(workers), HOST="127.0.0.1", PORT=str(port))
+    if mode == 'prefork':
+        command = [sys.executable, os.path.join(_HERE, 'serve.py')]
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1',
+                   '--port', str(port), '--workers', str(workers)]
+    start = time.perf_counter()
+    proc = subprocess.Popen(command, cwd=_HERE, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True)
+    ready = threading.Event()
+
+    def follow():
+        count = 0
+        for line in proc.stdout:
+            count += _READY in line
+            if count >= workers:
+                ready.set()
+
+    threading.Thread(target=follow, daemon=True).start()
+    try:
+        if not ready.wait(timeout):
+            raise RuntimeError(f"{mode}: workers not ready after {timeout:.0f}s")
+        startup_s = time.perf_counter() - start
+
+        def snapshot() -> Dict:
+            per_worker = [memory_mb(pid) for pid in worker_pids(proc.pid)]
+            supervisor = memory_mb(proc.pid)
+            return {
+                'workers': per_worker,
+                'total_rss_mb': supervisor['rss_mb'] + sum(w['rss_mb'] for w in per_worker),
+                'total_pss_mb': supervisor['pss_mb'] + sum(w['pss_mb'] for w in per_worker),
+            }
+
+        idle = snapshot()
+        questions = _questions()
+        with ThreadPoolExecutor(max_workers=2 * workers) as pool:
+            list(pool.map(lambda i: _chat(port, *questions[i % len(questions)]), range(requests)))
+        return {'mode': mode, 'startup_s': startup_s, 'idle': idle, 'loaded': snapshot()}
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['measure']:
+        workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+        for offset, mode in enumerate(('prefork', 'uvicorn')):
+            result = measure(mode, workers, PORT + 100 + offset)
+            print(f"{mode}: {workers} workers ready in {result['startup_s']:.1f}s")
+            for label in ('idle', 'loaded'):
+                row = result[label]
+                per_worker = '  '.join(f"{w['rss_mb']:.0f}/{w['pss_mb']:.0f}" for w in row['workers'])
+                print(f"  {label:<6} worker RSS/PSS MB: {per_worker}  "
+                      f"total RSS {row['total_rss_mb']:.0f} MB, PSS {row['total_pss_mb']:.0f} MB")
+        sys.exit(0)
+
+    serve()
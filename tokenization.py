@@ -0,0 +1,94 @@
+import os
+import re
+import unicodedata
+from typing import Callable, Dict, Iterable, List
+
+# Tokenizer used for the Japanese keyword index and queries: "ngram"
+# (character bigrams, no dependencies), "janome" (morphological analysis,
+# needs the pure-Python janome package) or "word" (regex words, the old
+# behaviour, which treats an unspaced sentence as a single word).
+JP_TOKENIZER = os.getenv("JP_TOKENIZER", "ngram")
+
+Tokenizer = Callable[[str], List[str]]
+
+_RUN = re.compile(r'[^\W_]+')
+_SEGMENT = re.compile(r'[0-9a-z]+|[^0-9a-z]+')
+
+
+def _normalize(text: str) -> str:
+    return unicodedata.normalize('NFKC', text).lower()
+
+
+def word_tokenize(text: str) -> List[str]:
+    return _RUN.findall(_normalize(text))
+
+
+class CharNGramTokenizer:
+    """Latin words stay whole; runs of other scripts become character n-grams.
+
+    Runs shorter than `n` are emitted as they are.
+    """
+
+    def __init__(self, n: int = 2):
+        self.n = n
+
+    def __call__(self, text: str) -> List[str]:
+        tokens = []
+        for run in _RUN.findall(_normalize(text)):
+            for seg in _SEGMENT.findall(run):
+                if seg[0].isascii() or len(seg) <= self.n:
+                    tokens.append(seg)
+                else:
+                    tokens.extend(seg[i:i + self.n] for i in range(len(seg) - self.n + 1))
+        return tokens
+
+
+class JanomeTokenizer:
+    """Surface forms from janome's analyzer, skipping symbols and whitespace."""
+
+    def __init__(self):
+        from janome.tokenizer import Tokenizer as _Janome
+
+        self._tokenizer = _Janome()
+
+    def __call__(self, text: str) -> List[str]:
+        return [t.surface for t in self._tokenizer.tokenize(_normalize(text))
+                if not t.part_of_speech.startswith('記号') and t.surface.strip()]
+
+
+def get_tokenizer(name: str = JP_TOKENIZER) -> Tokenizer:
+    if name == 'ngram':
+        return CharNGramTokenizer()
+    if name == 'janome':
+        return JanomeTokenizer()
+    if name == 'word':
+        return word_tokenize
+    raise ValueError(f"Unknown tokenizer: {name}")
+
+
+class TokenIndex:
+    """Inverted index from tokens to the keywords containing them.
+
+    `match` returns the keywords all of whose tokens occur in the query,
+    probing only the postings of the query's own tokens.
+    """
+
+    __slots__ = ('_keywords', '_postings', '_sizes')
+
+    def __init__(self, keywords: Iterable[str], tokenizer: Tokenizer):
+        self._keywords = list(keywords)
+        self._postings: Dict[str, List[int]] = {}
+        self._sizes: List[int] = []
+        for rank, kw in enumerate(self._keywords):
+            tokens = set(tokenizer(kw))
+            self._sizes.append(len(tokens))
+            for token in tokens:
+                self._postings.setdefault(token, []).append(rank)
+
+    def match(self, query_tokens: Iterable[str]) -> List[str]:
+        covered: Dict[int, int] = {}
+        for token in set(query_tokens):
+            for rank in self._postings.get(token, ()):
+                covered[rank] = covered.get(rank, 0) + 1
+        return [self._keywords[rank] for rank in sorted(covered)
+                if covered[rank] == self._sizes[rank]]